@@ -0,0 +1,28 @@
+from dotenv import load_dotenv
+import os
+import logging
+from datetime import datetime, timedelta
+
+load_dotenv()
+
+from loguru import logger
+from fediseer.flask import OVERSEER
+from fediseer import consts
+import fediseer.database.functions as database
+
+# Moves the reports older than FEDISEER_REPORT_RETENTION_DAYS into the reports_archive table,
+# keeping the reports table small for /reports and the activity lookups.
+# Archived reports older than FEDISEER_REPORT_ARCHIVE_DAYS are deleted. Set it to 0 to keep them forever.
+# Run this periodically, e.g. daily from cron
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(module)s:%(lineno)d - %(message)s', level=logging.WARNING)
+    logger.init("Report Archival", status="Starting")
+    retention_days = int(os.getenv("FEDISEER_REPORT_RETENTION_DAYS", consts.REPORT_RETENTION_DAYS))
+    archive_days = int(os.getenv("FEDISEER_REPORT_ARCHIVE_DAYS", 0))
+    with OVERSEER.app_context():
+        archived = database.archive_reports(datetime.utcnow() - timedelta(days=retention_days))
+        logger.info(f"Archived {archived} reports older than {retention_days} days")
+        if archive_days > 0:
+            purged = database.purge_archived_reports(datetime.utcnow() - timedelta(days=archive_days))
+            logger.info(f"Deleted {purged} archived reports older than {archive_days} days")
+    logger.init("Report Archival", status="Ended")
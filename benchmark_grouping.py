@@ -0,0 +1,100 @@
+from dotenv import load_dotenv
+import os
+import time
+import random
+import logging
+
+load_dotenv()
+
+# The benchmark seeds its own throwaway database instead of using the configured one
+os.environ["USE_SQLITE"] = "1"
+os.environ["FEDISEER_SQLITE_DB"] = ":memory:"
+os.environ.setdefault("FEDISEER_LEMMY_DOMAIN", "fediseer.com")
+os.environ.setdefault("ADMIN_API_KEY", "Password")
+
+from loguru import logger
+from sqlalchemy import insert, select
+from fediseer.flask import OVERSEER, db
+from fediseer.classes.instance import Instance, Censure
+from fediseer.utils import group_by_attribute
+import fediseer.database.functions as database
+
+REFERENCE_DOMAINS = 25
+CENSURES_PER_DOMAIN = 1000
+TARGET_INSTANCES = 5000
+# The default limit of /censures_given
+LISTED_INSTANCES = 1000
+
+def seed_censures(rng):
+    '''Adds the reference and target instances, where every reference censures CENSURES_PER_DOMAIN distinct targets.
+    Returns the ids of the reference instances
+    '''
+    db.session.execute(
+        insert(Instance),
+        [
+            {
+                "domain": f"instance{number}.example",
+                "software": "lemmy",
+                "version": "0.19.0",
+                "open_registrations": False,
+                "email_verify": False,
+            }
+            for number in range(REFERENCE_DOMAINS + TARGET_INSTANCES)
+        ]
+    )
+    instance_ids = db.session.execute(select(Instance.id).where(Instance.id != 0).order_by(Instance.id)).scalars().all()
+    reference_ids = instance_ids[:REFERENCE_DOMAINS]
+    target_ids = instance_ids[REFERENCE_DOMAINS:]
+    censures = []
+    for censuring_id in reference_ids:
+        for censured_id in rng.sample(target_ids, CENSURES_PER_DOMAIN):
+            censures.append({"censuring_id": censuring_id, "censured_id": censured_id, "reason": f"reason {censured_id}"})
+    db.session.execute(insert(Censure), censures)
+    db.session.commit()
+    logger.init_ok(f"{len(reference_ids)} reference domains with {len(censures)} censures", status="Seeded")
+    return reference_ids
+
+def group_by_scanning(censures, listed_instances):
+    '''How the given censures, endorsements and hesitations were matched to their targets before 0.26.0'''
+    return {
+        listed_instance.id: [censure for censure in censures if censure.censured_id == listed_instance.id]
+        for listed_instance in listed_instances
+    }
+
+def group_by_index(censures, listed_instances):
+    '''How /censures_given, /approvals and /hesitations_given match them now'''
+    censures_by_target = group_by_attribute(censures, "censured_id")
+    return {
+        listed_instance.id: censures_by_target.get(listed_instance.id, [])
+        for listed_instance in listed_instances
+    }
+
+def measure(name, group_function, censures, listed_instances):
+    start = time.time()
+    grouped = group_function(censures, listed_instances)
+    seconds = time.time() - start
+    logger.init_ok(
+        f"{name}: grouped {len(censures)} censures for {len(listed_instances)} instances in {round(seconds * 1000, 1)}ms",
+        status="Measured",
+    )
+    return grouped
+
+# Compares matching the given censures to their listed instances by scanning versus by group_by_attribute(),
+# on the rows /censures_given loads for its first page with 25 reference domains.
+# /approvals and /hesitations_given group their rows the same way. Run it with -v to see the results
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(module)s:%(lineno)d - %(message)s', level=logging.WARNING)
+    logger.init("Grouping Benchmark", status="Starting")
+    with OVERSEER.app_context():
+        reference_ids = seed_censures(random.Random(0))
+        listed_instances = database.get_all_censured_instances_by_censuring_id(reference_ids, limit=LISTED_INSTANCES)
+        censures = database.get_all_censures_from_censuring_id(
+            reference_ids,
+            censured_ids=[listed_instance.id for listed_instance in listed_instances],
+        )
+        scanned = measure("Scanning", group_by_scanning, censures, listed_instances)
+        indexed = measure("Grouped index", group_by_index, censures, listed_instances)
+        if scanned != indexed:
+            logger.init_err("Both groupings should match the same censures to each instance", status="Mismatch")
+            raise SystemExit(1)
+    logger.init("Grouping Benchmark", status="Ended")
@@ -0,0 +1,113 @@
+from dotenv import load_dotenv
+import os
+import time
+import random
+import logging
+from datetime import datetime, timedelta
+
+load_dotenv()
+
+# The benchmark seeds its own throwaway database instead of using the configured one
+os.environ["USE_SQLITE"] = "1"
+os.environ["FEDISEER_SQLITE_DB"] = ":memory:"
+os.environ.setdefault("FEDISEER_LEMMY_DOMAIN", "fediseer.com")
+os.environ.setdefault("ADMIN_API_KEY", "Password")
+
+from loguru import logger
+from sqlalchemy import insert, select, or_
+from sqlalchemy.orm import joinedload
+from fediseer.flask import OVERSEER, db
+from fediseer.classes.instance import Instance, Guarantee, Endorsement
+import fediseer.database.functions as database
+
+MIN_ENDORSEMENTS = 2
+MIN_GUARANTORS = 1
+GUARANTEED_RATIO = 0.8
+ENDORSEMENTS_PER_INSTANCE = 3
+
+def get_joined_instance_query(min_endorsements, min_guarantors):
+    '''The whitelist query as it was before 0.26.0, which joins the relationships and groups them by instance'''
+    return db.session.query(
+        Instance
+    ).outerjoin(
+        Instance.endorsements,
+        Instance.guarantors,
+    ).options(
+        joinedload(Instance.guarantors),
+        joinedload(Instance.endorsements),
+        joinedload(Instance.admins),
+        joinedload(Instance.guarantors),
+        joinedload(Instance.tags)
+    ).group_by(
+        Instance.id
+    ).filter(
+        or_(
+            Instance.oprhan_since == None,
+            Instance.oprhan_since > datetime.utcnow() - timedelta(hours=24)
+        )
+    ).having(
+        db.func.count(Instance.endorsements) >= min_endorsements,
+    ).having(
+        db.func.count(Instance.guarantors) >= min_guarantors,
+    )
+
+def seed_instances(instance_count, rng):
+    '''Adds instances with guarantee chains down from the admin instance and random endorsements between them'''
+    db.session.execute(
+        insert(Instance),
+        [
+            {
+                "domain": f"instance{number}.example",
+                "software": "lemmy",
+                "version": "0.19.0",
+                "open_registrations": False,
+                "email_verify": False,
+            }
+            for number in range(instance_count)
+        ]
+    )
+    instance_ids = db.session.execute(select(Instance.id).order_by(Instance.id)).scalars().all()
+    guarantees = []
+    for index, instance_id in enumerate(instance_ids[1:], start=1):
+        if rng.random() < GUARANTEED_RATIO:
+            guarantees.append({"guarantor_id": instance_ids[rng.randrange(index)], "guaranteed_id": instance_id})
+    db.session.execute(insert(Guarantee), guarantees)
+    endorsements = []
+    for instance_id in instance_ids:
+        endorsed_ids = set(rng.sample(instance_ids, ENDORSEMENTS_PER_INSTANCE)) - {instance_id}
+        endorsements.extend({"approving_id": instance_id, "endorsed_id": endorsed_id} for endorsed_id in endorsed_ids)
+    db.session.execute(insert(Endorsement), endorsements)
+    database.refresh_instance_counters()
+    database.rebuild_chain_roots()
+    db.session.commit()
+    logger.init_ok(f"{len(instance_ids)} instances, {len(guarantees)} guarantees and {len(endorsements)} endorsements", status="Seeded")
+
+def measure(name, query):
+    '''Times the main statement alone, then loading and serializing the instances like /whitelist does'''
+    start = time.time()
+    rows = len(db.session.connection().execute(query.statement).fetchall())
+    statement_seconds = time.time() - start
+    # Loading from the identity map would skip most of the work
+    db.session.expunge_all()
+    start = time.time()
+    instance_details = [instance.get_details() for instance in query.all()]
+    load_seconds = time.time() - start
+    db.session.expunge_all()
+    logger.init_ok(
+        f"{name}: {rows} rows from the main statement in {round(statement_seconds, 2)}s. "
+        f"{len(instance_details)} instances loaded and serialized in {round(load_seconds, 2)}s",
+        status="Measured",
+    )
+
+# Compares the whitelist query before and after 0.26.0 on a synthetic database,
+# by the rows its main statement returns and the time to load and serialize the instances.
+# Set FEDISEER_BENCHMARK_INSTANCES to change the amount of seeded instances. Run it with -v to see the results
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(module)s:%(lineno)d - %(message)s', level=logging.WARNING)
+    logger.init("Whitelist Benchmark", status="Starting")
+    instance_count = int(os.getenv("FEDISEER_BENCHMARK_INSTANCES", 50000))
+    with OVERSEER.app_context():
+        seed_instances(instance_count, random.Random(0))
+        measure("Joined query", get_joined_instance_query(MIN_ENDORSEMENTS, MIN_GUARANTORS))
+        measure("Current query", database.get_all_instance_query(min_endorsements=MIN_ENDORSEMENTS, min_guarantors=MIN_GUARANTORS))
+    logger.init("Whitelist Benchmark", status="Ended")
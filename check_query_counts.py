@@ -0,0 +1,106 @@
+from dotenv import load_dotenv
+import os
+import logging
+
+load_dotenv()
+
+# The check seeds its own throwaway database instead of using the configured one
+os.environ["USE_SQLITE"] = "1"
+os.environ["FEDISEER_SQLITE_DB"] = ":memory:"
+os.environ.setdefault("FEDISEER_LEMMY_DOMAIN", "fediseer.com")
+os.environ.setdefault("ADMIN_API_KEY", "Password")
+
+from loguru import logger
+from sqlalchemy import event
+from fediseer.flask import OVERSEER, db, cache
+from fediseer.classes.instance import Instance, Guarantee, Endorsement, Censure, Hesitation
+import fediseer.database.functions as database
+
+# How many related rows are seeded before each measurement.
+# The endpoints have to issue the same amount of statements for every size
+SEED_SIZES = [5, 50, 200]
+CHECKED_PATHS = [
+    "/api/v1/whitelist?limit=100",
+    "/api/v1/endorsements/target.example",
+    "/api/v1/censures/target.example",
+    "/api/v1/hesitations/target.example",
+    "/api/v1/censures_given/reference.example",
+    "/api/v1/approvals/reference.example",
+]
+
+class StatementCounter:
+    '''Counts the SQL statements sent to the database'''
+
+    def __init__(self):
+        self.count = 0
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+def add_instance(domain, guarantor_id):
+    instance = Instance(
+        domain=domain,
+        software="lemmy",
+        version="0.19.0",
+        open_registrations=False,
+        email_verify=False,
+    )
+    db.session.add(instance)
+    db.session.flush()
+    db.session.add(Guarantee(guarantor_id=guarantor_id, guaranteed_id=instance.id))
+    return instance
+
+def seed_instances(first, amount, target, reference):
+    '''Adds instances which all endorse, censure and hesitate about the target, and are all endorsed and censured by the reference'''
+    for number in range(first, first + amount):
+        instance = add_instance(f"instance{number}.example", reference.id)
+        db.session.add(Endorsement(approving_id=instance.id, endorsed_id=target.id, reason=f"reason {number}"))
+        db.session.add(Censure(censuring_id=instance.id, censured_id=target.id, reason=f"reason {number}"))
+        db.session.add(Hesitation(hesitant_id=instance.id, dubious_id=target.id, reason=f"reason {number}"))
+        db.session.add(Endorsement(approving_id=reference.id, endorsed_id=instance.id))
+        db.session.add(Censure(censuring_id=reference.id, censured_id=instance.id, reason=f"reason {number}"))
+    database.refresh_instance_counters()
+    database.rebuild_chain_roots()
+    db.session.commit()
+
+def count_statements(client, counter, path):
+    # Cached responses would not query at all
+    cache.clear()
+    counter.count = 0
+    response = client.get(path)
+    if response.status_code != 200:
+        raise Exception(f"{path} responded with {response.status_code}: {response.get_data(as_text=True)}")
+    return counter.count
+
+# Checks that the endpoints which list related instances query the database a constant amount of times,
+# no matter how many related rows there are. A growing count means an N+1 query pattern crept in.
+# Exits with an error if any endpoint's statement count grows with the seeded rows. Run it with -v to see the counts
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(module)s:%(lineno)d - %(message)s', level=logging.WARNING)
+    logger.init("Query Count Check", status="Starting")
+    counter = StatementCounter()
+    client = OVERSEER.test_client()
+    statement_counts = {path: [] for path in CHECKED_PATHS}
+    with OVERSEER.app_context():
+        root = database.find_instance_by_domain(os.getenv("FEDISEER_LEMMY_DOMAIN"))
+        reference = add_instance("reference.example", root.id)
+        target = add_instance("target.example", root.id)
+        db.session.commit()
+        event.listen(db.engine, "before_cursor_execute", counter.before_cursor_execute)
+        seeded = 0
+        for seed_size in SEED_SIZES:
+            seed_instances(seeded, seed_size - seeded, target, reference)
+            seeded = seed_size
+            for path in CHECKED_PATHS:
+                statement_counts[path].append(count_statements(client, counter, path))
+        event.remove(db.engine, "before_cursor_execute", counter.before_cursor_execute)
+    failed = False
+    for path, counts in statement_counts.items():
+        if len(set(counts)) == 1:
+            logger.init_ok(f"{path}: {counts[0]} statements for {SEED_SIZES} related rows", status="Constant")
+        else:
+            logger.init_err(f"{path}: statements for {SEED_SIZES} related rows: {counts}", status="Growing")
+            failed = True
+    logger.init("Query Count Check", status="Ended")
+    if failed:
+        raise SystemExit(1)
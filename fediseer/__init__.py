@@ -18,12 +18,16 @@ def after_request(response):
     response.headers["Access-Control-Allow-Origin"] = "*"
     response.headers["Access-Control-Allow-Methods"] = "POST, GET, OPTIONS, PUT, DELETE, PATCH"
     response.headers["Access-Control-Allow-Headers"] = "Accept, Content-Type, Content-Length, Accept-Encoding, X-CSRF-Token, apikey, Client-Agent, X-Fields"
+    response.headers["Access-Control-Expose-Headers"] = "X-Next-Cursor"
     response.headers["Fediseer-Node"] = f"{socket.gethostname()}:{args.port}:{FEDISEER_VERSION}"
-    try:
-        etag = hashlib.sha1(response.get_data()).hexdigest()
-    except RuntimeError:
-        etag = "Runtime Error"
-    response.headers["ETag"] = etag
+    # Responses like the snapshots set their own ETag
+    # and hashing a streamed response would load all of it into memory
+    if "ETag" not in response.headers and not response.is_streamed:
+        try:
+            etag = hashlib.sha1(response.get_data()).hexdigest()
+        except RuntimeError:
+            etag = "Runtime Error"
+        response.headers["ETag"] = etag
     return response
 
 if args.test:
@@ -0,0 +1,122 @@
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from threading import Lock
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from fediseer.flask import cache
+from fediseer.classes.reports import Report
+from fediseer.consts import ACTION_COUNTER_WINDOW, MAX_CONFIG_ACTIONS_PER_MIN
+
+class MemoryActionCounter:
+    '''Counts the actions of each domain in this process only, so each worker has its own limit.
+    Only suitable when the fediseer runs as a single process, as otherwise every process allows the full limit.
+    Every domain keeps a ring of one-second buckets covering the window,
+    so recording and counting actions do not depend on how many reports exist.
+    '''
+
+    def __init__(self, window):
+        self.window = window
+        self.buckets = {}
+        self.lock = Lock()
+
+    def record(self, domain):
+        now = int(time.time())
+        with self.lock:
+            domain_buckets = self.buckets.get(domain)
+            if domain_buckets is None:
+                domain_buckets = deque(maxlen=self.window)
+                self.buckets[domain] = domain_buckets
+            if domain_buckets and domain_buckets[-1][0] == now:
+                domain_buckets[-1][1] += 1
+            else:
+                domain_buckets.append([now, 1])
+
+    def count(self, domain):
+        oldest = int(time.time()) - self.window
+        with self.lock:
+            domain_buckets = self.buckets.get(domain)
+            if domain_buckets is None:
+                return 0
+            while domain_buckets and domain_buckets[0][0] <= oldest:
+                domain_buckets.popleft()
+            if not domain_buckets:
+                del self.buckets[domain]
+                return 0
+            return sum(bucket[1] for bucket in domain_buckets)
+
+class CacheActionCounter:
+    '''Counts the actions of each domain in the flask cache, in one-second buckets.
+    This is the default, as recording and counting an action does not query the database.
+    The counts are shared by all threads of the process, and by all workers when the cache is shared (e.g. redis).
+    '''
+
+    def __init__(self, window):
+        self.window = window
+
+    def get_bucket_key(self, domain, second):
+        return f"actions:{domain}:{second}"
+
+    def record(self, domain):
+        key = self.get_bucket_key(domain, int(time.time()))
+        # add() only sets the expiry when the bucket does not exist yet
+        cache.add(key, 0, timeout=self.window + 1)
+        cache.cache.inc(key)
+
+    def count(self, domain):
+        now = int(time.time())
+        keys = [self.get_bucket_key(domain, second) for second in range(now - self.window + 1, now + 1)]
+        return sum(bucket for bucket in cache.get_many(*keys) if bucket is not None)
+
+class DatabaseActionCounter:
+    '''Counts the reports each domain created in the window, through the (source_domain, created) index.
+    This costs a query per request, but the count is shared between all workers and processes without a shared cache.
+    '''
+
+    def __init__(self, window):
+        self.window = window
+
+    def record(self, domain):
+        # The reports themselves are the record
+        pass
+
+    def count(self, domain):
+        return Report.query.filter_by(
+            source_domain=domain
+        ).filter(
+            Report.created > datetime.utcnow() - timedelta(seconds=self.window),
+        ).count()
+
+ACTION_COUNTER_BACKENDS = {
+    "memory": MemoryActionCounter,
+    "cache": CacheActionCounter,
+    "database": DatabaseActionCounter,
+}
+
+action_counter_backend = os.getenv("FEDISEER_ACTION_COUNTER", "cache")
+if action_counter_backend not in ACTION_COUNTER_BACKENDS:
+    logger.warning(f"Unknown action counter '{action_counter_backend}'. Falling back to 'cache'")
+    action_counter_backend = "cache"
+action_counter = ACTION_COUNTER_BACKENDS[action_counter_backend](ACTION_COUNTER_WINDOW)
+
+def has_too_many_actions(domain):
+    return action_counter.count(domain) > MAX_CONFIG_ACTIONS_PER_MIN
+
+# Every report is an action of its source domain, same as the reports counted by the database backend.
+# They are only recorded once committed, so that rolled back reports do not count
+REPORT_ACTIONS_KEY = "report_action_domains"
+
+@event.listens_for(Report, "after_insert")
+def queue_report_action(mapper, connection, target):
+    object_session(target).info.setdefault(REPORT_ACTIONS_KEY, []).append(target.source_domain)
+
+@event.listens_for(Session, "after_commit")
+def record_report_actions(session):
+    for domain in session.info.pop(REPORT_ACTIONS_KEY, []):
+        action_counter.record(domain)
+
+@event.listens_for(Session, "after_rollback")
+def discard_report_actions(session):
+    session.info.pop(REPORT_ACTIONS_KEY, None)
@@ -22,6 +22,7 @@ api.add_resource(activitypub.User, "/user/<string:username>")
 api.add_resource(activitypub.Inbox, "/inbox/<string:username>")
 api.add_resource(whitelist.Whitelist, "/whitelist")
 api.add_resource(whitelist.AllInstances, "/all_instances")
+api.add_resource(whitelist.InstancesExport, "/export/instances")
 api.add_resource(solicitations.Solicitations, "/solicitations")
 api.add_resource(whitelist.WhitelistDomain, "/whitelist/<string:domain>")
 api.add_resource(endorsements.Endorsements, "/endorsements/<string:domain>")
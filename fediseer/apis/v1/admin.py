@@ -33,7 +33,7 @@ class Flag(Resource):
         admin_instance = database.find_instance_by_user(user)
         target_instance, instance_info = ensure_instance_registered(domain)
         flag = enums.InstanceFlags[self.args.flag]
-        if database.instance_has_flag(target_instance.id,flag):
+        if target_instance.has_flag(flag):
             return {"message": "OK"},200
         new_flag = InstanceFlag(
             instance_id = target_instance.id,
@@ -41,7 +41,7 @@ class Flag(Resource):
             comment = self.args.comment,
         )
         db.session.add(new_flag)
-        if flag == enums.InstanceFlags.RESTRICTED and not database.instance_has_flag(target_instance.id,enums.InstanceFlags.MUTED):
+        if flag == enums.InstanceFlags.RESTRICTED and not target_instance.has_flag(enums.InstanceFlags.MUTED):
             muted_flag = InstanceFlag(
                 instance_id = target_instance.id,
                 flag = enums.InstanceFlags.MUTED,
@@ -1,9 +1,9 @@
 from fediseer.apis.v1.base import *
 from fediseer.classes.instance import Censure
-from fediseer.utils import sanitize_string
+from fediseer.utils import sanitize_string, encode_cursor, decode_cursor, parse_reasons_csv, group_by_attribute
 from fediseer.classes.reports import Report
 from fediseer import enums, consts
-from fediseer.register import ensure_instance_registered
+from fediseer.register import ensure_instance_registered, ensure_instances_registered
 
 class CensuresGiven(Resource):
     get_parser = reqparse.RequestParser()
@@ -13,8 +13,9 @@ class CensuresGiven(Resource):
     get_parser.add_argument("domains", required=False, type=bool, help="Set to true to return just the domains as a list. Mutually exclusive with csv", location="args")
     get_parser.add_argument("min_censures", required=False, default=1, type=int, help="Limit to this amount of censures of more", location="args")
     get_parser.add_argument("reasons_csv", required=False, type=str, help="Only retrieve censures where their reasons include any of the text in this csv", location="args")
-    get_parser.add_argument("page", required=False, type=int, default=1, help="Which page of results to retrieve. Only unfiltered results will be paginated.", location="args")
-    get_parser.add_argument("limit", required=False, type=int, default=1000, help="Which amount of results to retrieve. Only unfiltered results will be limited.", location="args")
+    get_parser.add_argument("page", required=False, type=int, default=1, help="Which page of results to retrieve.", location="args")
+    get_parser.add_argument("limit", required=False, type=int, default=1000, help="Which amount of results to retrieve.", location="args")
+    get_parser.add_argument("cursor", required=False, type=str, help="The next_cursor of a previous response, to retrieve the page after it. Takes precedence over page.", location="args")
 
     decorators = [limiter.limit("45/minute"), limiter.limit("30/minute", key_func = get_request_path)]
     @api.expect(get_parser)
@@ -60,73 +61,61 @@ class CensuresGiven(Resource):
         if self.args.min_censures > len(instances):
             raise e.BadRequest(f"You cannot request more censures than the amount of reference domains")
         instance_details = []
-        limit = self.args.limit
+        reasons_filter = None
         if self.args.reasons_csv:
-            limit = None
-        if self.args.min_censures and self.args.min_censures != 1:
-            limit = None
-        censures = database.get_all_censures_from_censuring_id([instance.id for instance in instances])
-        if self.args.reasons_csv:
-            reasons_filter = [r.strip().lower() for r in self.args.reasons_csv.split(',')]
-            reasons_filter = set(reasons_filter)
-            if "__all_pedos__" in reasons_filter:
-                reasons_filter.add("csam")
-                reasons_filter.add("loli")
-                reasons_filter.add("shota")
-                reasons_filter.add("pedophil")
-            if "__all_bigots__" in reasons_filter:
-                reasons_filter.add("racism")
-                reasons_filter.add("sexism")
-                reasons_filter.add("transphobia")
-                reasons_filter.add("homophobia")
-                reasons_filter.add("islamophobia")
-                reasons_filter.add("nazi")
-                reasons_filter.add("fascist")
-                reasons_filter.add("hate speech")
-                reasons_filter.add("bigotry")
-        for c_instance in database.get_all_censured_instances_by_censuring_id(
+            reasons_filter = parse_reasons_csv(self.args.reasons_csv)
+        cursor = None
+        if self.args.cursor is not None:
+            cursor = decode_cursor(self.args.cursor, str)
+            if cursor is None:
+                raise e.BadRequest("Invalid cursor")
+            cursor = cursor[0]
+        listed_instances = database.get_all_censured_instances_by_censuring_id(
             censuring_ids = [instance.id for instance in instances],
             page=self.args.page,
-            limit=limit,
-        ):
-            c_censures = [c for c in censures if c.censured_id == c_instance.id]
+            limit=self.args.limit,
+            cursor=cursor,
+            min_censures=self.args.min_censures,
+            reasons=reasons_filter,
+        )
+        censures = database.get_all_censures_from_censuring_id(
+            [instance.id for instance in instances],
+            censured_ids=[listed_instance.id for listed_instance in listed_instances],
+        )
+        # Group once, so that each listed instance doesn't have to scan all censures
+        censures_by_target = group_by_attribute(censures, "censured_id")
+        next_cursor = None
+        if len(listed_instances) == self.args.limit:
+            next_cursor = encode_cursor(listed_instances[-1].domain)
+        for c_instance in listed_instances:
+            c_censures = censures_by_target.get(c_instance.id, [])
             censure_count = len(c_censures)
             r_censures = [c for c in c_censures if c.reason is not None]
             if self.args.csv or self.args.domains:
                 c_instance_details = {"domain": c_instance.domain}
             else:
                 c_instance_details = c_instance.get_details()
-            skip_instance = True
-            if self.args.reasons_csv:
-                for r in reasons_filter:
-                    reason_filter_counter = 0
-                    for censure in r_censures:
-                        if r in censure.reason.lower():
-                            reason_filter_counter += 1
-                    if reason_filter_counter >= self.args.min_censures:
-                        skip_instance = False
-                        break
-            elif censure_count >= self.args.min_censures:
-                skip_instance = False
-            if skip_instance:
-                continue
             c_instance_details["censure_reasons"] = [censure.reason for censure in r_censures]
             c_instance_details["censure_evidence"] = [censure.evidence for censure in r_censures if censure.evidence is not None]
             c_instance_details["censure_count"] = censure_count
             instance_details.append(c_instance_details)
+        total = database.count_all_censures_from_censuring_id([instance.id for instance in instances])
         if self.args.csv:
             return {
                 "csv": ",".join([instance["domain"] for instance in instance_details]),
-                "total": len(censures)
+                "total": total,
+                "next_cursor": next_cursor,
             },200
         if self.args.domains:
             return {
                 "domains": [instance["domain"] for instance in instance_details],
-                "total": len(censures)
+                "total": total,
+                "next_cursor": next_cursor,
             },200
         return {
             "instances": instance_details,
-            "total": len(censures)
+            "total": total,
+            "next_cursor": next_cursor,
         },200
             
 
@@ -177,7 +166,7 @@ class Censures(Resource):
                 c_instance_details["censure_reasons"] = [censure.reason for censure in censures_filtered]
                 c_instance_details["censure_evidence"] = [censure.evidence for censure in censures_filtered if censure.evidence is not None]
                 rebuttals_texts = [r.rebuttal for r in rebuttals if r.target_id == c_instance.id]
-                if len(rebuttals_texts) > 0 and not database.instance_has_flag(c_instance.id,enums.InstanceFlags.MUTED):
+                if len(rebuttals_texts) > 0 and not c_instance.has_flag(enums.InstanceFlags.MUTED):
                     c_instance_details["rebuttal"] = rebuttals_texts
             instance_details.append(c_instance_details)
         if self.args.csv:
@@ -221,13 +210,13 @@ class Censures(Resource):
             raise e.NotFound(f"No Instance found matching provided API key and domain. Have you remembered to register it?")
         if len(instance.guarantors) == 0:
             raise e.Forbidden("Only guaranteed instances can censure others.")
-        if database.instance_has_flag(instance.id,enums.InstanceFlags.RESTRICTED):
+        if instance.has_flag(enums.InstanceFlags.RESTRICTED):
             raise e.Forbidden("You cannot take this action as your instance is restricted")
         if instance.domain == domain:
             raise e.BadRequest("You're a mad lad, but you can't censure yourself.")
         if database.has_too_many_actions_per_min(instance.domain):
             raise e.TooManyRequests(f"Your instance is doing more than {consts.MAX_CONFIG_ACTIONS_PER_MIN} actions per minute. Please slow down.")
-        unbroken_chain, chainbreaker = database.has_unbroken_chain(instance.id)
+        unbroken_chain, chainbreaker = instance.has_unbroken_chain()
         if not unbroken_chain:
             raise e.Forbidden(f"Guarantee chain for this instance has been broken. Chain ends at {chainbreaker.domain}!")
         target_instance, instance_info = ensure_instance_registered(domain, allow_unreachable=True)
@@ -252,6 +241,7 @@ class Censures(Resource):
             evidence=evidence,
         )
         db.session.add(new_censure)
+        database.refresh_instance_counters([instance.id, target_instance.id])
         target_domain = target_instance.domain
         if instance.visibility_censures != enums.ListVisibility.OPEN:
             target_domain = '[REDACTED]'
@@ -354,6 +344,7 @@ class Censures(Resource):
         if not censure:
             return {"message":'OK'}, 200
         db.session.delete(censure)
+        database.refresh_instance_counters([instance.id, target_instance.id])
         target_domain = target_instance.domain
         if instance.visibility_censures != enums.ListVisibility.OPEN:
             target_domain = '[REDACTED]'
@@ -397,11 +388,11 @@ class BatchCensures(Resource):
             raise e.NotFound(f"No Instance found matching provided API key and domain. Have you remembered to register it?")
         if len(instance.guarantors) == 0:
             raise e.Forbidden("Only guaranteed instances can censure others.")
-        if database.instance_has_flag(instance.id,enums.InstanceFlags.RESTRICTED):
+        if instance.has_flag(enums.InstanceFlags.RESTRICTED):
             raise e.Forbidden("You cannot take this action as your instance is restricted")
         if database.has_too_many_actions_per_min(instance.domain):
             raise e.TooManyRequests(f"Your instance is doing more than {consts.MAX_CONFIG_ACTIONS_PER_MIN} actions per minute. Please slow down.")
-        unbroken_chain, chainbreaker = database.has_unbroken_chain(instance.id)
+        unbroken_chain, chainbreaker = instance.has_unbroken_chain()
         if not unbroken_chain:
             raise e.Forbidden(f"Guarantee chain for this instance has been broken. Chain ends at {chainbreaker.domain}!")
         if self.args.delete is True:
@@ -416,14 +407,20 @@ class BatchCensures(Resource):
         deleted_entries = 0
         modified_entries = 0
         seen_domains = set()
+        changed_instance_ids = {instance.id}
+        # Resolve all targets up front, so that unknown domains are polled concurrently
+        target_instances = ensure_instances_registered(
+            [entry["domain"] for entry in self.args.censures if entry["domain"] != instance.domain]
+        )
+        # The submitted list is diffed against the existing censures in memory and then applied in bulk
+        existing_censures = {censure.censured_id: censure for censure in database.get_all_censures_from_censuring_id([instance.id])}
+        endorsed_ids = set(endorsement.endorsed_id for endorsement in database.get_all_endorsements_from_approving_id([instance.id]))
         if self.args.delete:
-            existing_censures = database.get_all_censured_instances_by_censuring_id([instance.id], limit=None)
-            new_censures = set([c["domain"] for c in self.args.censures])
-            for target_instance in existing_censures:
-                if target_instance.domain not in new_censures:
-                    old_censure = database.get_censure(target_instance.id,instance.id)
-                    db.session.delete(old_censure)
-                    deleted_entries += 1
+            submitted_ids = set(t.id for t in target_instances.values() if t is not None)
+            stale_ids = [target_id for target_id in existing_censures if target_id not in submitted_ids]
+            deleted_entries = database.delete_censures(instance.id, stale_ids)
+            changed_instance_ids.update(stale_ids)
+        upserted_censures = {}
         for entry in self.args.censures:
             if entry["domain"] in seen_domains:
                 logger.info(f"Batch censure operation by {instance.domain} had duplicate entries for {entry['domain']}")
@@ -431,7 +428,7 @@ class BatchCensures(Resource):
             seen_domains.add(entry["domain"])
             if instance.domain == entry["domain"]:
                 continue
-            target_instance, instance_info = ensure_instance_registered(entry["domain"], allow_unreachable=True)
+            target_instance = target_instances.get(entry["domain"])
             reason = entry.get("reason")
             if reason is not None:
                 reason = sanitize_string(reason)
@@ -440,28 +437,25 @@ class BatchCensures(Resource):
                 evidence = sanitize_string(evidence)
             if not target_instance:
                 continue
-            if database.get_endorsement(target_instance.id,instance.id):
+            if target_instance.id in upserted_censures:
+                continue
+            if target_instance.id in endorsed_ids:
                 continue
-            censure = database.get_censure(target_instance.id,instance.id)            
+            censure = existing_censures.get(target_instance.id)
             if censure:
                 if self.args.overwrite is False:
                     continue
-                if censure.reason == reason and censure.evidence == evidence:  
+                if censure.reason == reason and censure.evidence == evidence:
                     continue
-                censure.reason = reason
-                censure.evidence = evidence
                 modified_entries += 1
-            else:             
-                new_censure = Censure(
-                    censuring_id=instance.id,
-                    censured_id=target_instance.id,
-                    reason=reason,
-                    evidence=evidence,
-                )
-                db.session.add(new_censure)
+            else:
+                changed_instance_ids.add(target_instance.id)
                 added_entries += 1
+            upserted_censures[target_instance.id] = {"censured_id": target_instance.id, "reason": reason, "evidence": evidence}
+        database.upsert_censures(instance.id, list(upserted_censures.values()))
         if added_entries + deleted_entries + modified_entries == 0:
             return {"message":'OK'}, 200
+        database.refresh_instance_counters(changed_instance_ids)
         if added_entries > 0:
             new_report = Report(
                 source_domain=instance.domain,
@@ -2,8 +2,8 @@ from fediseer.apis.v1.base import *
 from fediseer.classes.instance import Endorsement,Censure
 from fediseer.classes.reports import Report
 from fediseer import enums, consts
-from fediseer.utils import sanitize_string
-from fediseer.register import ensure_instance_registered
+from fediseer.utils import sanitize_string, encode_cursor, decode_cursor, parse_reasons_csv, group_by_attribute
+from fediseer.register import ensure_instance_registered, ensure_instances_registered
 
 class Approvals(Resource):
     get_parser = reqparse.RequestParser()
@@ -15,6 +15,7 @@ class Approvals(Resource):
     get_parser.add_argument("reasons_csv", required=False, type=str, help="Only retrieve endorsements where their reasons include any of the text in this csv", location="args")
     get_parser.add_argument("page", required=False, type=int, default=1, help="Which page of results to retrieve.", location="args")
     get_parser.add_argument("limit", required=False, type=int, default=1000, help="Which amount of results to retrieve.", location="args")
+    get_parser.add_argument("cursor", required=False, type=str, help="The next_cursor of a previous response, to retrieve the page after it. Takes precedence over page.", location="args")
 
     decorators = [limiter.limit("45/minute"), limiter.limit("30/minute", key_func = get_request_path)]
     @api.expect(get_parser)
@@ -60,50 +61,58 @@ class Approvals(Resource):
         if self.args.min_endorsements > len(instances):
             raise e.BadRequest(f"You cannot request more endorsements than the amount of reference domains")
         instance_details = []
-        endorsements = database.get_all_endorsements_from_approving_id([instance.id for instance in instances])
-        for e_instance in database.get_all_endorsed_instances_by_approving_id(
+        reasons_filter = None
+        if self.args.reasons_csv:
+            reasons_filter = parse_reasons_csv(self.args.reasons_csv)
+        cursor = None
+        if self.args.cursor is not None:
+            cursor = decode_cursor(self.args.cursor, str)
+            if cursor is None:
+                raise e.BadRequest("Invalid cursor")
+            cursor = cursor[0]
+        listed_instances = database.get_all_endorsed_instances_by_approving_id(
             approving_ids=[instance.id for instance in instances],
             page=self.args.page,
             limit=self.args.limit,
-        ):
-            e_endorsements = [e for e in endorsements if e.endorsed_id == e_instance.id]
-            endorsement_count = len(e_endorsements)
+            cursor=cursor,
+            min_endorsements=self.args.min_endorsements,
+            reasons=reasons_filter,
+        )
+        endorsements = database.get_all_endorsements_from_approving_id(
+            [instance.id for instance in instances],
+            endorsed_ids=[listed_instance.id for listed_instance in listed_instances],
+        )
+        # Group once, so that each listed instance doesn't have to scan all endorsements
+        endorsements_by_target = group_by_attribute(endorsements, "endorsed_id")
+        next_cursor = None
+        if len(listed_instances) == self.args.limit:
+            next_cursor = encode_cursor(listed_instances[-1].domain)
+        for e_instance in listed_instances:
+            e_endorsements = endorsements_by_target.get(e_instance.id, [])
             r_endorsements = [e for e in e_endorsements if e.reason is not None]
             if self.args.csv or self.args.domains:
                 e_instance_details = {"domain": e_instance.domain}
             else:
                 e_instance_details = e_instance.get_details()
-            skip_instance = True
-            if self.args.reasons_csv:
-                reasons_filter = [r.strip().lower() for r in self.args.reasons_csv.split(',')]
-                reasons_filter = set(reasons_filter)
-                for r in reasons_filter:
-                    reason_filter_counter = 0
-                    for endorsement in r_endorsements:
-                        if r in endorsement.reason.lower():
-                            reason_filter_counter += 1
-                    if reason_filter_counter >= self.args.min_endorsements:
-                        skip_instance = False
-                        break
-            elif endorsement_count >= self.args.min_endorsements:
-                skip_instance = False
-            if skip_instance:
-                continue
             e_instance_details["endorsement_reasons"] = [endorsement.reason for endorsement in r_endorsements]
             instance_details.append(e_instance_details)
+        total = database.count_all_endorsements_from_approving_id([instance.id for instance in instances])
         if self.args.csv:
             return {
                 "csv": ",".join([instance["domain"] for instance in instance_details]),
-                "total": len(endorsements)
+                "total": total,
+                "next_cursor": next_cursor,
             },200
         if self.args.domains:
             return {
                 "domains": [instance["domain"] for instance in instance_details],
-                "total": len(endorsements)
+                "total": total,
+                "next_cursor": next_cursor,
             },200
         return {
             "instances": instance_details,
-            "total": len(endorsements)
+            "total": total,
+            "next_cursor": next_cursor,
         },200
 
 class Endorsements(Resource):
@@ -145,12 +154,15 @@ class Endorsements(Resource):
                 if p_instance != get_instance:
                     continue
             instances.append(p_instance)
+        endorsements = database.get_all_endorsement_reasons_for_endorsed_id(instance.id, [e.id for e in instances])
+        reasons_by_approving_id = {}
+        for endorsement in endorsements:
+            if endorsement.reason is not None:
+                reasons_by_approving_id.setdefault(endorsement.approving_id, []).append(endorsement.reason)
         for e_instance in instances:
-            endorsements = database.get_all_endorsement_reasons_for_endorsed_id(instance.id, [e_instance.id])
-            endorsements = [e for e in endorsements if e.reason is not None]
             e_instance_details = e_instance.get_details()
-            if len(endorsements) > 0:
-                e_instance_details["endorsement_reasons"] = [endorsement.reason for endorsement in endorsements]
+            if e_instance.id in reasons_by_approving_id:
+                e_instance_details["endorsement_reasons"] = reasons_by_approving_id[e_instance.id]
             instance_details.append(e_instance_details)
         if self.args.csv:
             return {
@@ -193,13 +205,13 @@ class Endorsements(Resource):
             raise e.NotFound(f"No Instance found matching provided API key and domain. Have you remembered to register it?")
         if len(instance.guarantors) == 0:
             raise e.Forbidden("Only guaranteed instances can endorse others.")
-        if database.instance_has_flag(instance.id,enums.InstanceFlags.RESTRICTED):
+        if instance.has_flag(enums.InstanceFlags.RESTRICTED):
             raise e.Forbidden("You cannot take this action as your instance is restricted")
         if instance.domain == domain:
             raise e.BadRequest("Nice try, but you can't endorse yourself.")
         if database.has_too_many_actions_per_min(instance.domain):
             raise e.TooManyRequests(f"Your instance is doing more than {consts.MAX_CONFIG_ACTIONS_PER_MIN} actions per minute. Please slow down.")
-        unbroken_chain, chainbreaker = database.has_unbroken_chain(instance.id)
+        unbroken_chain, chainbreaker = instance.has_unbroken_chain()
         if not unbroken_chain:
             raise e.Forbidden(f"Guarantee chain for this instance has been broken. Chain ends at {chainbreaker.domain}!")
         target_instance, instance_info = ensure_instance_registered(domain)
@@ -224,6 +236,7 @@ class Endorsements(Resource):
             reason=reason,
         )
         db.session.add(new_endorsement)
+        database.refresh_instance_counters([instance.id, target_instance.id])
         target_domain = target_instance.domain
         if instance.visibility_endorsements != enums.ListVisibility.OPEN:
             target_domain = '[REDACTED]'
@@ -334,6 +347,7 @@ class Endorsements(Resource):
         if not endorsement:
             return {"message":'OK'}, 200
         db.session.delete(endorsement)
+        database.refresh_instance_counters([instance.id, target_instance.id])
         target_domain = target_instance.domain
         if instance.visibility_endorsements != enums.ListVisibility.OPEN:
             target_domain = '[REDACTED]'
@@ -387,11 +401,11 @@ class BatchEndorsements(Resource):
             raise e.NotFound(f"No Instance found matching provided API key and domain. Have you remembered to register it?")
         if len(instance.guarantors) == 0:
             raise e.Forbidden("Only guaranteed instances can endorse others.")
-        if database.instance_has_flag(instance.id,enums.InstanceFlags.RESTRICTED):
+        if instance.has_flag(enums.InstanceFlags.RESTRICTED):
             raise e.Forbidden("You cannot take this action as your instance is restricted")
         if database.has_too_many_actions_per_min(instance.domain):
             raise e.TooManyRequests(f"Your instance is doing more than {consts.MAX_CONFIG_ACTIONS_PER_MIN} actions per minute. Please slow down.")
-        unbroken_chain, chainbreaker = database.has_unbroken_chain(instance.id)
+        unbroken_chain, chainbreaker = instance.has_unbroken_chain()
         if not unbroken_chain:
             raise e.Forbidden(f"Guarantee chain for this instance has been broken. Chain ends at {chainbreaker.domain}!")
         if self.args.delete is True:
@@ -406,14 +420,21 @@ class BatchEndorsements(Resource):
         deleted_entries = 0
         modified_entries = 0
         seen_domains = set()
+        changed_instance_ids = {instance.id}
+        # Resolve all targets up front, so that unknown domains are polled concurrently
+        target_instances = ensure_instances_registered(
+            [entry["domain"] for entry in self.args.endorsements if entry["domain"] != instance.domain]
+        )
+        # The submitted list is diffed against the existing endorsements in memory and then applied in bulk
+        existing_endorsements = {endorsement.endorsed_id: endorsement for endorsement in database.get_all_endorsements_from_approving_id([instance.id])}
+        censured_ids = set(censure.censured_id for censure in database.get_all_censures_from_censuring_id([instance.id]))
+        dubious_ids = set(hesitation.dubious_id for hesitation in database.get_all_hesitations_from_hesitant_id([instance.id]))
         if self.args.delete:
-            existing_endorsements = database.get_all_endorsed_instances_by_approving_id([instance.id], limit=None)
-            new_endorsements = set([c["domain"] for c in self.args.endorsements])
-            for target_instance in existing_endorsements:
-                if target_instance.domain not in new_endorsements:
-                    old_endorsement = database.get_endorsement(target_instance.id,instance.id)
-                    db.session.delete(old_endorsement)
-                    deleted_entries += 1
+            submitted_ids = set(t.id for t in target_instances.values() if t is not None)
+            stale_ids = [target_id for target_id in existing_endorsements if target_id not in submitted_ids]
+            deleted_entries = database.delete_endorsements(instance.id, stale_ids)
+            changed_instance_ids.update(stale_ids)
+        upserted_endorsements = {}
         for entry in self.args.endorsements:
             if entry["domain"] in seen_domains:
                 logger.info(f"Batch endorsement operation by {instance.domain} had duplicate entries for {entry['domain']}")
@@ -421,34 +442,33 @@ class BatchEndorsements(Resource):
             seen_domains.add(entry["domain"])
             if instance.domain == entry["domain"]:
                 continue
-            target_instance, instance_info = ensure_instance_registered(entry["domain"], allow_unreachable=True)
+            target_instance = target_instances.get(entry["domain"])
             reason = entry.get("reason")
             if reason is not None:
                 reason = sanitize_string(reason)
             if not target_instance:
                 continue
-            if database.get_censure(target_instance.id,instance.id):
+            if target_instance.id in upserted_endorsements:
                 continue
-            if database.get_hesitation(target_instance.id,instance.id):
+            if target_instance.id in censured_ids:
                 continue
-            endorsement = database.get_endorsement(target_instance.id,instance.id)            
+            if target_instance.id in dubious_ids:
+                continue
+            endorsement = existing_endorsements.get(target_instance.id)
             if endorsement:
                 if self.args.overwrite is False:
                     continue
-                if endorsement.reason == reason:  
+                if endorsement.reason == reason:
                     continue
-                endorsement.reason = reason
                 modified_entries += 1
-            else:             
-                new_endorsement = Endorsement(
-                    approving_id=instance.id,
-                    endorsed_id=target_instance.id,
-                    reason=reason,
-                )
-                db.session.add(new_endorsement)
+            else:
+                changed_instance_ids.add(target_instance.id)
                 added_entries += 1
+            upserted_endorsements[target_instance.id] = {"endorsed_id": target_instance.id, "reason": reason}
+        database.upsert_endorsements(instance.id, list(upserted_endorsements.values()))
         if added_entries + deleted_entries + modified_entries == 0:
             return {"message":'OK'}, 200
+        database.refresh_instance_counters(changed_instance_ids)
         if added_entries > 0:
             new_report = Report(
                 source_domain=instance.domain,
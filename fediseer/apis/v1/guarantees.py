@@ -87,11 +87,11 @@ class Guarantees(Resource):
             raise e.Forbidden("Only guaranteed instances can guarantee others.")
         if len(instance.guarantees) >= consts.MAX_GUARANTEES and instance.id != 0:
             raise e.Forbidden(f"You cannot guarantee for more than {consts.MAX_GUARANTEES} instances")
-        if database.instance_has_flag(instance.id,enums.InstanceFlags.RESTRICTED):
+        if instance.has_flag(enums.InstanceFlags.RESTRICTED):
             raise e.Forbidden("You cannot take this action as your instance is restricted")
         if database.has_too_many_actions_per_min(instance.domain):
             raise e.TooManyRequests(f"Your instance is doing more than {consts.MAX_CONFIG_ACTIONS_PER_MIN} actions per minute. Please slow down.")
-        unbroken_chain, chainbreaker = database.has_unbroken_chain(instance.id)
+        unbroken_chain, chainbreaker = instance.has_unbroken_chain()
         if not unbroken_chain:
             raise e.Forbidden(f"Guarantee chain for this instance has been broken. Chain ends at {chainbreaker.domain}!")
         target_instance, instance_info = ensure_instance_registered(domain)
@@ -107,7 +107,8 @@ class Guarantees(Resource):
             guarantor_id=instance.id,
         )
         db.session.add(new_guarantee)
-        if database.instance_has_flag(instance.id,enums.InstanceFlags.MUTED):
+        database.refresh_chain_root(target_instance.id)
+        if instance.has_flag(enums.InstanceFlags.MUTED):
             muted_flag = InstanceFlag(
                 instance_id=target_instance.id,
                 flag=enums.InstanceFlags.MUTED,
@@ -123,6 +124,7 @@ class Guarantees(Resource):
         )
         db.session.add(new_report)
         db.session.commit()
+        database.invalidate_solicitations()
         try:
             activitypub_pm.pm_admins(
                 message=f"Congratulations! Your instance has just been [guaranteed](https://fediseer.com/faq#what-is-a-guarantee) by {instance.domain}. \n\nThis is an automated PM by the [Fediseer](https://fediseer.com) service. Replies will not be read.\nPlease contact @db0@lemmy.dbzer0.com for further inquiries.",
@@ -185,6 +187,7 @@ class Guarantees(Resource):
         endorsement = database.get_endorsement(target_instance.id,instance.id)
         if endorsement:
             db.session.delete(endorsement)
+            database.refresh_instance_counters([instance.id, target_instance.id])
         # Claimed Orphaned instances are automatically put into the solicitation list
         if target_instance.is_claimed():
             new_solicitation = Solicitation(
@@ -202,6 +205,7 @@ class Guarantees(Resource):
             )
             db.session.add(solicitation_report)
         db.session.delete(guarantee)
+        database.refresh_chain_root(target_instance.id)
         rejection_record = database.get_rejection_record(instance.id,target_instance.id)
         if rejection_record:
             rejection_record.refresh()
@@ -220,6 +224,7 @@ class Guarantees(Resource):
 
         db.session.add(new_report)
         db.session.commit()
+        database.invalidate_solicitations()
         try:
             activitypub_pm.pm_admins(
                 message=f"Attention! You guarantor instance {instance.domain} has withdrawn their [guarantee](https://fediseer.com/faq#what-is-a-guarantee).\n\n"
@@ -1,9 +1,9 @@
 from fediseer.apis.v1.base import *
 from fediseer.classes.instance import Hesitation
-from fediseer.utils import sanitize_string
+from fediseer.utils import sanitize_string, encode_cursor, decode_cursor, parse_reasons_csv, group_by_attribute
 from fediseer.classes.reports import Report
 from fediseer import enums, consts
-from fediseer.register import ensure_instance_registered
+from fediseer.register import ensure_instance_registered, ensure_instances_registered
 
 class HesitationsGiven(Resource):
     get_parser = reqparse.RequestParser()
@@ -13,8 +13,9 @@ class HesitationsGiven(Resource):
     get_parser.add_argument("domains", required=False, type=bool, help="Set to true to return just the domains as a list. Mutually exclusive with csv", location="args")
     get_parser.add_argument("min_hesitations", required=False, default=1, type=int, help="Limit to this amount of hesitations of more", location="args")
     get_parser.add_argument("reasons_csv", required=False, type=str, help="Only retrieve hesitations where their reasons include any of the text in this csv", location="args")
-    get_parser.add_argument("page", required=False, type=int, default=1, help="Which page of results to retrieve. Only unfiltered results will be paginated.", location="args")
-    get_parser.add_argument("limit", required=False, type=int, default=1000, help="Which amount of results to retrieve. Only unfiltered results will be limited.", location="args")
+    get_parser.add_argument("page", required=False, type=int, default=1, help="Which page of results to retrieve.", location="args")
+    get_parser.add_argument("limit", required=False, type=int, default=1000, help="Which amount of results to retrieve.", location="args")
+    get_parser.add_argument("cursor", required=False, type=str, help="The next_cursor of a previous response, to retrieve the page after it. Takes precedence over page.", location="args")
 
     decorators = [limiter.limit("45/minute"), limiter.limit("30/minute", key_func = get_request_path)]
     @api.expect(get_parser)
@@ -60,57 +61,61 @@ class HesitationsGiven(Resource):
         if self.args.min_hesitations > len(instances):
             raise e.BadRequest(f"You cannot request more hesitations than the amount of reference domains")
         instance_details = []
-        limit = self.args.limit
+        reasons_filter = None
         if self.args.reasons_csv:
-            limit = None
-        if self.args.min_hesitations and self.args.min_hesitations != 1:
-            limit = None
-        hesitations = database.get_all_hesitations_from_hesitant_id([instance.id for instance in instances])
-        for c_instance in database.get_all_dubious_instances_by_hesitant_id(
+            reasons_filter = parse_reasons_csv(self.args.reasons_csv)
+        cursor = None
+        if self.args.cursor is not None:
+            cursor = decode_cursor(self.args.cursor, str)
+            if cursor is None:
+                raise e.BadRequest("Invalid cursor")
+            cursor = cursor[0]
+        listed_instances = database.get_all_dubious_instances_by_hesitant_id(
             hesitant_ids=[instance.id for instance in instances],
             page=self.args.page,
-            limit=limit,
-        ):
-            h_hesitations = [c for c in hesitations if c.dubious_id == c_instance.id]
+            limit=self.args.limit,
+            cursor=cursor,
+            min_hesitations=self.args.min_hesitations,
+            reasons=reasons_filter,
+        )
+        hesitations = database.get_all_hesitations_from_hesitant_id(
+            [instance.id for instance in instances],
+            dubious_ids=[listed_instance.id for listed_instance in listed_instances],
+        )
+        # Group once, so that each listed instance doesn't have to scan all hesitations
+        hesitations_by_target = group_by_attribute(hesitations, "dubious_id")
+        next_cursor = None
+        if len(listed_instances) == self.args.limit:
+            next_cursor = encode_cursor(listed_instances[-1].domain)
+        for c_instance in listed_instances:
+            h_hesitations = hesitations_by_target.get(c_instance.id, [])
             hesitation_count = len(h_hesitations)
             r_hesitations = [c for c in h_hesitations if c.reason is not None]
             if self.args.csv or self.args.domains:
                 c_instance_details = {"domain": c_instance.domain}
             else:
                 c_instance_details = c_instance.get_details()
-            skip_instance = True
-            if self.args.reasons_csv:
-                reasons_filter = [r.strip().lower() for r in self.args.reasons_csv.split(',')]
-                reasons_filter = set(reasons_filter)
-                for r in reasons_filter:
-                    reason_filter_counter = 0
-                    for hesitation in r_hesitations:
-                        if r in hesitation.reason.lower():
-                            reason_filter_counter += 1
-                    if reason_filter_counter >= self.args.min_hesitations:
-                        skip_instance = False
-                        break
-            elif hesitation_count >= self.args.min_hesitations:
-                skip_instance = False
-            if skip_instance:
-                continue
             c_instance_details["hesitation_reasons"] = [hesitation.reason for hesitation in r_hesitations]
             c_instance_details["hesitation_evidence"] = [hesitation.evidence for hesitation in r_hesitations if hesitation.evidence is not None]
             c_instance_details["hesitation_count"] = hesitation_count
             instance_details.append(c_instance_details)
+        total = database.count_all_hesitations_from_hesitant_id([instance.id for instance in instances])
         if self.args.csv:
             return {
                 "csv": ",".join([instance["domain"] for instance in instance_details]),
-                "total": len(hesitations)
+                "total": total,
+                "next_cursor": next_cursor,
             },200
         if self.args.domains:
             return {
                 "domains": [instance["domain"] for instance in instance_details],
-                "total": len(hesitations)
+                "total": total,
+                "next_cursor": next_cursor,
             },200       
         return {
             "instances": instance_details,
-            "total": len(hesitations)
+            "total": total,
+            "next_cursor": next_cursor,
         },200
 
 class Hesitations(Resource):
@@ -203,13 +208,13 @@ class Hesitations(Resource):
             raise e.NotFound(f"No Instance found matching provided API key and domain. Have you remembered to register it?")
         if len(instance.guarantors) == 0:
             raise e.Forbidden("Only guaranteed instances can hesitation others.")
-        if database.instance_has_flag(instance.id,enums.InstanceFlags.RESTRICTED):
+        if instance.has_flag(enums.InstanceFlags.RESTRICTED):
             raise e.Forbidden("You cannot take this action as your instance is restricted")
         if instance.domain == domain:
             raise e.BadRequest("You're a mad lad, but you can't hesitation yourself.")
         if database.has_too_many_actions_per_min(instance.domain):
             raise e.TooManyRequests(f"Your instance is doing more than {consts.MAX_CONFIG_ACTIONS_PER_MIN} actions per minute. Please slow down.")
-        unbroken_chain, chainbreaker = database.has_unbroken_chain(instance.id)
+        unbroken_chain, chainbreaker = instance.has_unbroken_chain()
         if not unbroken_chain:
             raise e.Forbidden(f"Guarantee chain for this instance has been broken. Chain ends at {chainbreaker.domain}!")
         target_instance, instance_info = ensure_instance_registered(domain, allow_unreachable=True)
@@ -236,6 +241,7 @@ class Hesitations(Resource):
             evidence=evidence,
         )
         db.session.add(new_hesitation)
+        database.refresh_instance_counters([instance.id, target_instance.id])
         target_domain = target_instance.domain
         if instance.visibility_hesitations != enums.ListVisibility.OPEN:
             target_domain = '[REDACTED]'
@@ -338,6 +344,7 @@ class Hesitations(Resource):
         if not hesitation:
             return {"message":'OK'}, 200
         db.session.delete(hesitation)
+        database.refresh_instance_counters([instance.id, target_instance.id])
         target_domain = target_instance.domain
         if instance.visibility_hesitations != enums.ListVisibility.OPEN:
             target_domain = '[REDACTED]'
@@ -380,11 +387,11 @@ class BatchHesitations(Resource):
             raise e.NotFound(f"No Instance found matching provided API key and domain. Have you remembered to register it?")
         if len(instance.guarantors) == 0:
             raise e.Forbidden("Only guaranteed instances can doubt others.")
-        if database.instance_has_flag(instance.id,enums.InstanceFlags.RESTRICTED):
+        if instance.has_flag(enums.InstanceFlags.RESTRICTED):
             raise e.Forbidden("You cannot take this action as your instance is restricted")
         if database.has_too_many_actions_per_min(instance.domain):
             raise e.TooManyRequests(f"Your instance is doing more than {consts.MAX_CONFIG_ACTIONS_PER_MIN} actions per minute. Please slow down.")
-        unbroken_chain, chainbreaker = database.has_unbroken_chain(instance.id)
+        unbroken_chain, chainbreaker = instance.has_unbroken_chain()
         if not unbroken_chain:
             raise e.Forbidden(f"Guarantee chain for this instance has been broken. Chain ends at {chainbreaker.domain}!")
         if self.args.delete is True:
@@ -399,14 +406,20 @@ class BatchHesitations(Resource):
         deleted_entries = 0
         modified_entries = 0
         seen_domains = set()
+        changed_instance_ids = {instance.id}
+        # Resolve all targets up front, so that unknown domains are polled concurrently
+        target_instances = ensure_instances_registered(
+            [entry["domain"] for entry in self.args.hesitations if entry["domain"] != instance.domain]
+        )
+        # The submitted list is diffed against the existing hesitations in memory and then applied in bulk
+        existing_hesitations = {hesitation.dubious_id: hesitation for hesitation in database.get_all_hesitations_from_hesitant_id([instance.id])}
+        endorsed_ids = set(endorsement.endorsed_id for endorsement in database.get_all_endorsements_from_approving_id([instance.id]))
         if self.args.delete:
-            existing_hesitations = database.get_all_dubious_instances_by_hesitant_id([instance.id], limit=None)
-            new_hesitations = set([c["domain"] for c in self.args.hesitations])
-            for target_instance in existing_hesitations:
-                if target_instance.domain not in new_hesitations:
-                    old_hesitation = database.get_hesitation(target_instance.id,instance.id)   
-                    db.session.delete(old_hesitation)
-                    deleted_entries += 1
+            submitted_ids = set(t.id for t in target_instances.values() if t is not None)
+            stale_ids = [target_id for target_id in existing_hesitations if target_id not in submitted_ids]
+            deleted_entries = database.delete_hesitations(instance.id, stale_ids)
+            changed_instance_ids.update(stale_ids)
+        upserted_hesitations = {}
         for entry in self.args.hesitations:
             if entry["domain"] in seen_domains:
                 logger.info(f"Batch hesitation operation by {instance.domain} had duplicate entries for {entry['domain']}")
@@ -414,7 +427,7 @@ class BatchHesitations(Resource):
             seen_domains.add(entry["domain"])
             if instance.domain == entry["domain"]:
                 continue
-            target_instance, instance_info = ensure_instance_registered(entry["domain"], allow_unreachable=True)
+            target_instance = target_instances.get(entry["domain"])
             reason = entry.get("reason")
             if reason is not None:
                 reason = sanitize_string(reason)
@@ -423,28 +436,25 @@ class BatchHesitations(Resource):
                 evidence = sanitize_string(evidence)
             if not target_instance:
                 continue
-            if database.get_endorsement(target_instance.id,instance.id):
+            if target_instance.id in upserted_hesitations:
+                continue
+            if target_instance.id in endorsed_ids:
                 continue
-            hesitation = database.get_hesitation(target_instance.id,instance.id)            
+            hesitation = existing_hesitations.get(target_instance.id)
             if hesitation:
                 if self.args.overwrite is False:
                     continue
-                if hesitation.reason == reason and hesitation.evidence == evidence:  
+                if hesitation.reason == reason and hesitation.evidence == evidence:
                     continue
-                hesitation.reason = reason
-                hesitation.evidence = evidence
                 modified_entries += 1
-            else:             
-                new_hesitation = Hesitation(
-                    hesitant_id=instance.id,
-                    dubious_id=target_instance.id,
-                    reason=reason,
-                    evidence=evidence,
-                )
-                db.session.add(new_hesitation)
+            else:
+                changed_instance_ids.add(target_instance.id)
                 added_entries += 1
+            upserted_hesitations[target_instance.id] = {"dubious_id": target_instance.id, "reason": reason, "evidence": evidence}
+        database.upsert_hesitations(instance.id, list(upserted_hesitations.values()))
         if added_entries + deleted_entries + modified_entries == 0:
             return {"message":'OK'}, 200
+        database.refresh_instance_counters(changed_instance_ids)
         if added_entries > 0:
             new_report = Report(
                 source_domain=instance.domain,
@@ -30,11 +30,11 @@ class Rebuttals(Resource):
             raise e.NotFound(f"No Instance found matching provided API key and domain. Have you remembered to register it?")
         if len(instance.guarantors) == 0:
             raise e.Forbidden("Only guaranteed instances can rebut.")
-        if database.instance_has_flag(instance.id,enums.InstanceFlags.RESTRICTED):
+        if instance.has_flag(enums.InstanceFlags.RESTRICTED):
             raise e.Forbidden("You cannot take this action as your instance is restricted")
         if database.has_too_many_actions_per_min(instance.domain):
             raise e.TooManyRequests(f"Your instance is doing more than {consts.MAX_CONFIG_ACTIONS_PER_MIN} actions per minute. Please slow down.")
-        unbroken_chain, chainbreaker = database.has_unbroken_chain(instance.id)
+        unbroken_chain, chainbreaker = instance.has_unbroken_chain()
         if not unbroken_chain:
             raise e.Forbidden(f"Guarantee chain for this instance has been broken. Chain ends at {chainbreaker.domain}!")
         target_instance = database.find_instance_by_domain(domain)
@@ -1,5 +1,7 @@
+from datetime import datetime
 from fediseer.apis.v1.base import *
 from fediseer import enums
+from fediseer.utils import encode_cursor, decode_cursor
 
 class Report(Resource):
 
@@ -10,14 +12,26 @@ class Report(Resource):
     get_parser.add_argument("report_type", required=False, default=None, type=str, help=f"The activity of report to filer {[e.name for e in enums.ReportType]}", location="args")
     get_parser.add_argument("report_activity", required=False, default=None, type=str, help=f"The activity of report to filer {[e.name for e in enums.ReportActivity]}", location="args")
     get_parser.add_argument("page", required=False, default=1, type=int, help=f"The page of reports to display.", location="args")
+    get_parser.add_argument("limit", required=False, default=10, type=int, help=f"How many reports to display per page.", location="args")
+    get_parser.add_argument("cursor", required=False, type=str, help="The X-Next-Cursor header of a previous response, to retrieve the page after it. Takes precedence over page", location="args")
 
     @api.expect(get_parser)
     @api.marshal_with(models.response_model_reports, code=200, description='Report', as_list=True)
     @api.response(400, 'Validation Error', models.response_model_error)
     def get(self):
-        '''Retrieve instance information via API Key at 10 results per page
+        '''Retrieve the activity reports, at 10 results per page by default
+        When a full page is returned, the X-Next-Cursor header holds the cursor of the next page
         '''
         self.args = self.get_parser.parse_args()
+        if self.args.limit > 100:
+            raise e.BadRequest("limit cannot be more than 100")
+        if self.args.limit < 1:
+            raise e.BadRequest("limit cannot be less than 1")
+        cursor = None
+        if self.args.cursor is not None:
+            cursor = decode_cursor(self.args.cursor, datetime, int)
+            if cursor is None:
+                raise e.BadRequest("Invalid cursor")
         source_domains = None
         if self.args.source_domains_csv:
             source_domains = self.args.source_domains_csv.split(',')
@@ -42,6 +56,8 @@ class Report(Resource):
             report_type=report_type,
             report_activity=report_activity,
             page=self.args.page,
+            limit=self.args.limit,
+            cursor=cursor,
         )
         report_response = []
         for r in reports:
@@ -54,4 +70,7 @@ class Report(Resource):
                     'created': r.created.isoformat() + 'Z',
                 }
             )
-        return report_response,200
+        headers = {}
+        if len(reports) == self.args.limit:
+            headers["X-Next-Cursor"] = encode_cursor(reports[-1].created, reports[-1].id)
+        return report_response,200,headers
@@ -11,17 +11,20 @@ class Solicitations(Resource):
     get_parser.add_argument("domains", required=False, type=bool, help="Set to true to return just the domains as a list. Mutually exclusive with csv", location="args")
 
     @api.expect(get_parser, query_string=True)
-    @cache.cached(timeout=10)
     @api.marshal_with(models.response_model_model_Solicitation_get, code=200, description='Soliciting Instances', skip_none=True)
     def get(self):
         '''A List with all the currently open solicitations for guarantees.
         '''
         self.args = self.get_parser.parse_args()
-        instance_details = []
-        for instance in database.get_all_solicitations():
-            instance_detail = instance.get_details()
-            instance_detail["comment"] = database.find_latest_solicitation_by_source(instance.id).comment
-            instance_details.append(instance_detail)
+        # Cached until a solicitation is added or removed, or for SOLICITATIONS_CACHE_SECONDS
+        instance_details = cache.get(database.SOLICITATIONS_CACHE_KEY)
+        if instance_details is None:
+            instance_details = []
+            for instance, oldest_solicitation_date, latest_comment in database.get_all_solicitations():
+                instance_detail = instance.get_details()
+                instance_detail["comment"] = latest_comment
+                instance_details.append(instance_detail)
+            cache.set(database.SOLICITATIONS_CACHE_KEY, instance_details, timeout=consts.SOLICITATIONS_CACHE_SECONDS)
         if self.args.csv:
             return {"csv": ",".join([instance["domain"] for instance in instance_details])},200
         if self.args.domains:
@@ -85,6 +88,7 @@ class Solicitations(Resource):
         )
         db.session.add(new_report)
         db.session.commit()
+        database.invalidate_solicitations()
         if guarantor_instance:
             try:
                 activitypub_pm.pm_admins(
@@ -2,6 +2,7 @@ from fediseer.apis.v1.base import *
 from fediseer import enums
 from fediseer.classes.instance import InstanceTag
 from fediseer.consts import MAX_TAGS
+from fediseer.utils import normalize_tag
 
 class Tags(Resource):
 
@@ -16,7 +17,7 @@ class Tags(Resource):
 
     def get(self):
         '''Display all known tags (converted to lowercase)
-        And count how many times they've been used
+        And count how many times they've been used. Tags differing only in case are counted together
         '''
         self.args = self.get_parser.parse_args()
         rows_dict = database.get_tag_counts()
@@ -48,23 +49,28 @@ class Tags(Resource):
         instance = database.find_instance_by_user(user)
         changed = False
         tags = [t.strip() for t in self.args.tags_csv.split(',')]
-        if database.instance_has_flag(instance.id,enums.InstanceFlags.RESTRICTED):
+        if instance.has_flag(enums.InstanceFlags.RESTRICTED):
             raise e.Forbidden("You cannot take this action as your instance is restricted")
         if database.count_instance_tags(instance.id) + len(tags) >= MAX_TAGS:
             raise e.BadRequest(f"You can't have more than {MAX_TAGS} tags")
         if len(tags) != len(set([t.lower() for t in tags])):
             raise e.BadRequest("You cannot specify the same tag with different case.")
+        added_tags = {}
         for tag in tags:
             if database.instance_has_tag(instance.id,tag):
                 continue
             new_tag = InstanceTag(
                 instance_id = instance.id,
                 tag = tag,
+                tag_norm = normalize_tag(tag),
             )
             db.session.add(new_tag)
+            added_tags[tag] = 1
             changed = True
         if changed:
+            database.adjust_tag_counts(added_tags)
             db.session.commit()
+            database.invalidate_instance_totals()
             return {"message": "Changed"},200
         return {"message": "OK"},200
         
@@ -91,12 +97,18 @@ class Tags(Resource):
         instance = database.find_instance_by_user(user)
         changed = False
         tags = [t.strip() for t in self.args.tags_csv.split(',')]
+        removed_tags = {}
         for tag in tags:
-            existing_tag = database.get_instance_tag(instance.id,tag)
-            if existing_tag:
+            existing_tags = database.get_instance_tags(instance.id,tag)
+            if len(existing_tags) == 0:
+                continue
+            for existing_tag in existing_tags:
                 db.session.delete(existing_tag)
-                changed = True
+            removed_tags[tag] = -1
+            changed = True
         if changed:
+            database.adjust_tag_counts(removed_tags)
             db.session.commit()
+            database.invalidate_instance_totals()
             return {"message": "Changed"},200
         return {"message": "OK"},200
\ No newline at end of file
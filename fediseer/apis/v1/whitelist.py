@@ -7,10 +7,14 @@ from fediseer.classes.reports import Report
 from fediseer.register import ensure_instance_registered
 from fediseer.flask import OVERSEER
 import os
-import time
+import io
+import csv
 import json
-import threading
-import sys
+from datetime import datetime
+from flask import Response, stream_with_context
+from flask_restx import marshal
+from fediseer.utils import encode_cursor, decode_cursor
+from fediseer.snapshots import Snapshot
 
 class Whitelist(Resource):
     get_parser = reqparse.RequestParser()
@@ -18,9 +22,11 @@ class Whitelist(Resource):
     get_parser.add_argument("endorsements", required=False, default=0, type=int, help="Limit to this amount of endorsements of more", location="args")
     get_parser.add_argument("guarantors", required=False, default=1, type=int, help="Limit to this amount of guarantors of more", location="args")
     get_parser.add_argument("tags_csv", required=False, type=str, help="A list of tags to filter.", location="args")
+    get_parser.add_argument("tags_match", required=False, default="ANY", type=str, help=f"Whether instances need to have any or all of the tags_csv {[e.name for e in enums.TagsMatch]}", location="args")
     get_parser.add_argument("software_csv", required=False, type=str, help="show only instances running one of this software", location="args")
     get_parser.add_argument("page", required=False, type=int, default=1, help="Which page of results to retrieve", location="args")
     get_parser.add_argument("limit", required=False, type=int, default=100, help="Which page of results to retrieve", location="args")
+    get_parser.add_argument("cursor", required=False, type=str, help="The next_cursor of a previous response, to retrieve the page after it. Takes precedence over page", location="args")
     get_parser.add_argument("csv", required=False, type=bool, help="Set to true to return just the domains as a csv. Mutually exclusive with domains", location="args")
     get_parser.add_argument("domains", required=False, type=bool, help="Set to true to return just the domains as a list. Mutually exclusive with csv", location="args")
 
@@ -38,89 +44,184 @@ class Whitelist(Resource):
         tags = None
         if self.args.tags_csv is not None:
             tags = [t.strip() for t in self.args.tags_csv.split(',')]
+        try:
+            tags_match = enums.TagsMatch[self.args.tags_match.upper()]
+        except KeyError as err:
+            raise e.BadRequest(f"'{self.args.tags_match}' is not a valid TagsMatch")
         software = None
         if self.args.software_csv is not None:
             software = [s.strip() for s in self.args.software_csv.split(',')]
+        cursor = None
+        if self.args.cursor is not None:
+            cursor = decode_cursor(self.args.cursor, datetime, int)
+            if cursor is None:
+                raise e.BadRequest("Invalid cursor")
         instance_details = []
         all_instances = database.get_all_instances(
             min_endorsements=self.args.endorsements,
             min_guarantors=self.args.guarantors,
             tags=tags,
+            tags_match=tags_match,
             software=software,
             page=self.args.page,
             limit=self.args.limit,
+            cursor=cursor,
         )
         for instance in all_instances:
             instance_details.append(instance.get_details(show_visibilities=True))
+        total = database.count_all_instances(
+            min_endorsements=self.args.endorsements,
+            min_guarantors=self.args.guarantors,
+            tags=tags,
+            tags_match=tags_match,
+            software=software,
+            approximate=True,
+        )
+        next_cursor = None
+        if len(all_instances) == self.args.limit:
+            next_cursor = encode_cursor(all_instances[-1].created, all_instances[-1].id)
         if self.args.csv:
             return {
                 "csv": ",".join([instance["domain"] for instance in instance_details]),
-                "total": database.count_all_instances()
+                "total": total,
+                "next_cursor": next_cursor,
             },200
         if self.args.domains:
             return {
                 "domains": [instance["domain"] for instance in instance_details],
-                "total": database.count_all_instances()
+                "total": total,
+                "next_cursor": next_cursor,
             },200
         return {
             "instances": instance_details,
-            "total": database.count_all_instances()
+            "total": total,
+            "next_cursor": next_cursor,
         },200
 
+def build_all_instances():
+    instance_details = []
+    all_instances = database.get_all_instances(
+        min_guarantors=0,
+        limit=None,
+    )
+    for instance in all_instances:
+        instance_details.append(instance.get_details(show_visibilities=True))
+    return marshal(
+        {
+            "instances": instance_details,
+            "total": len(instance_details)
+        },
+        models.response_model_model_Whitelist_get,
+        skip_none=True,
+    )
+
+all_instances_snapshot = Snapshot("all_instances", build_all_instances, consts.ALL_INSTANCES_SNAPSHOT_SECONDS)
+
 class AllInstances(Resource):
     get_parser = reqparse.RequestParser()
     get_parser.add_argument("Client-Agent", default="unknown:0:unknown", type=str, required=False, help="The client name and version.", location="headers")
+    get_parser.add_argument("If-None-Match", required=False, type=str, help="The ETag of a previous response. If the snapshot has not changed since, a 304 is returned", location="headers")
 
     @api.expect(get_parser)
-    @cache.cached(timeout=3600)
-    @api.marshal_with(models.response_model_model_Whitelist_get, code=200, description='All Instances', skip_none=True)
+    @api.response(200, 'All Instances', models.response_model_model_Whitelist_get)
+    @api.response(304, 'Not Modified')
     def get(self):
         '''A List with the details of all instances and their endorsements unfiltered
+        This is served from a snapshot which is refreshed every hour
         '''
         self.args = self.get_parser.parse_args()
-        instance_details = None
-        main_path = os.path.dirname(sys.modules['__main__'].__file__)
-        json_path = os.path.join(main_path, "all_instances.json")
-        try:
-            if os.path.isfile(json_path):
-                mtime = os.path.getmtime(json_path)
-                if time.time() - mtime >= 3600:
-                    # Refresh the data if it is older than 1 hour
-                    threading.Thread(target=self.get_all_instances, daemon=True).start()
-                if time.time() - mtime < 3600:
-                    with open(json_path, "r") as f:
-                        instance_details = json.load(f)
-                        return {
-                            "instances": instance_details,
-                            "total": len(instance_details)
-                        },200
-        except Exception as err:
-            logger.error(f"Failed to read cached all_instances.json: {err}")
-            pass
-        instance_details = self.get_all_instances()
-        return {
-            "instances": instance_details,
-            "total": len(instance_details)
-        },200
+        return all_instances_snapshot.serve()
 
-    def get_all_instances(self):
-        '''A List with the details of all instances and their endorsements unfiltered
+
+EXPORT_CSV_COLUMNS = [
+    "id",
+    "domain",
+    "software",
+    "version",
+    "claimed",
+    "open_registrations",
+    "email_verify",
+    "approval_required",
+    "has_captcha",
+    "endorsements",
+    "approvals",
+    "guarantor",
+    "sysadmins",
+    "moderators",
+    "state",
+    "tags",
+    "visibility_endorsements",
+    "visibility_censures",
+    "visibility_hesitations",
+    "flags",
+]
+
+class InstancesExport(Resource):
+    decorators = [limiter.limit("10/minute", key_func = get_request_path)]
+    get_parser = reqparse.RequestParser()
+    get_parser.add_argument("Client-Agent", default="unknown:0:unknown", type=str, required=False, help="The client name and version.", location="headers")
+    get_parser.add_argument("endorsements", required=False, default=0, type=int, help="Limit to this amount of endorsements of more", location="args")
+    get_parser.add_argument("guarantors", required=False, default=1, type=int, help="Limit to this amount of guarantors of more", location="args")
+    get_parser.add_argument("tags_csv", required=False, type=str, help="A list of tags to filter.", location="args")
+    get_parser.add_argument("tags_match", required=False, default="ANY", type=str, help=f"Whether instances need to have any or all of the tags_csv {[e.name for e in enums.TagsMatch]}", location="args")
+    get_parser.add_argument("software_csv", required=False, type=str, help="show only instances running one of this software", location="args")
+    get_parser.add_argument("format", required=False, default="ndjson", type=str, choices=("ndjson", "csv"), help="ndjson to receive one instance JSON per line, or csv to receive one instance per row", location="args")
+
+    @api.expect(get_parser)
+    @api.response(200, 'Instances', models.response_model_instances_visibility)
+    @api.response(400, 'Bad Request', models.response_model_error)
+    def get(self):
+        '''Export the details of all instances matching the same filters as the whitelist
+        The instances are streamed as they are read from the database, without pagination.
+        In the csv format, tags and flags are comma-separated lists
         '''
-        main_path = os.path.dirname(sys.modules['__main__'].__file__)
-        json_path = os.path.join(main_path, "all_instances.json")
-        instance_details = []
-        with OVERSEER.app_context():
-            all_instances = database.get_all_instances(
-                min_guarantors=0,
-                limit=None,
-            )
-            for instance in all_instances:
-                logger.debug(instance.domain)
-                instance_details.append(instance.get_details(show_visibilities=True))
-            with open(json_path, "w") as f:
-                json.dump(instance_details, f)
-        return instance_details
+        self.args = self.get_parser.parse_args()
+        tags = None
+        if self.args.tags_csv is not None:
+            tags = [t.strip() for t in self.args.tags_csv.split(',')]
+        try:
+            tags_match = enums.TagsMatch[self.args.tags_match.upper()]
+        except KeyError as err:
+            raise e.BadRequest(f"'{self.args.tags_match}' is not a valid TagsMatch")
+        software = None
+        if self.args.software_csv is not None:
+            software = [s.strip() for s in self.args.software_csv.split(',')]
+        all_instances = database.stream_all_instances(
+            min_endorsements=self.args.endorsements,
+            min_guarantors=self.args.guarantors,
+            tags=tags,
+            tags_match=tags_match,
+            software=software,
+        )
+        if self.args.format == "csv":
+            rows = self.generate_csv(all_instances)
+            mimetype = "text/csv"
+        else:
+            rows = self.generate_ndjson(all_instances)
+            mimetype = "application/x-ndjson"
+        response = Response(stream_with_context(rows), mimetype=mimetype)
+        response.headers["Content-Disposition"] = f"attachment; filename=fediseer_instances.{self.args.format}"
+        return response
+
+    def get_instance_details(self, instance):
+        return marshal(instance.get_details(show_visibilities=True), models.response_model_instances_visibility)
 
+    def generate_ndjson(self, all_instances):
+        for instance in all_instances:
+            yield json.dumps(self.get_instance_details(instance), separators=(',', ':')) + "\n"
+
+    def generate_csv(self, all_instances):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_CSV_COLUMNS)
+        for instance in all_instances:
+            instance_details = self.get_instance_details(instance)
+            instance_details["tags"] = ",".join(instance_details["tags"] or [])
+            instance_details["flags"] = ",".join(flag["flag"] for flag in instance_details["flags"] or [])
+            writer.writerow([instance_details[column] for column in EXPORT_CSV_COLUMNS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
 
 class WhitelistDomain(Resource):
     get_parser = reqparse.RequestParser()
@@ -205,6 +306,7 @@ class WhitelistDomain(Resource):
             instance_id = instance.id,
         )
         db.session.add(new_claim)
+        database.refresh_instance_counters([instance.id])
         new_report = Report(
             source_domain=instance.domain,
             target_domain=instance.domain,
@@ -227,6 +329,7 @@ class WhitelistDomain(Resource):
             )
             db.session.add(solicitation_report)
             db.session.commit()
+            database.invalidate_solicitations()
             try:
                 activitypub_pm.pm_admins(
                     message=f"New instance {instance.domain} was just registered with the Fediseer and have solicited [your guarantee](https://gui.fediseer.com/guarantees/guarantee)!",
@@ -291,21 +394,21 @@ class WhitelistDomain(Resource):
         if self.args.visibility_endorsements is not None:
             visibility = enums.ListVisibility[self.args.visibility_endorsements]
             if instance.visibility_endorsements != visibility:
-                if database.instance_has_flag(instance.id,enums.InstanceFlags.MUTED):
+                if instance.has_flag(enums.InstanceFlags.MUTED):
                     raise e.Forbidden("Muted instances cannot change their visibility away from private!")
                 instance.visibility_endorsements = visibility
                 changed = True
         if self.args.visibility_censures is not None:
             visibility = enums.ListVisibility[self.args.visibility_censures]
             if instance.visibility_censures != visibility:
-                if database.instance_has_flag(instance.id,enums.InstanceFlags.MUTED):
+                if instance.has_flag(enums.InstanceFlags.MUTED):
                     raise e.Forbidden("Muted instances cannot change their visibility away from private!")
                 instance.visibility_censures = visibility
                 changed = True
         if self.args.visibility_hesitations is not None:
             visibility = enums.ListVisibility[self.args.visibility_hesitations]
             if instance.visibility_hesitations != visibility:
-                if database.instance_has_flag(instance.id,enums.InstanceFlags.MUTED):
+                if instance.has_flag(enums.InstanceFlags.MUTED):
                     raise e.Forbidden("Muted instances cannot change their visibility away from private!")
                 instance.visibility_hesitations = visibility
                 changed = True
@@ -341,6 +444,7 @@ class WhitelistDomain(Resource):
                 )
             user.api_key = hash_api_key(new_key)
             changed = True
+        # The old key stops working as soon as this is committed, as the auth cache drops it on commit
         db.session.commit()
         if changed is True:
             if self.args.return_new_key and new_key is not None:
@@ -0,0 +1,92 @@
+from threading import Lock
+from loguru import logger
+from sqlalchemy import event, select, inspect
+from sqlalchemy.orm import Session, object_session
+from fediseer.flask import cache
+from fediseer.classes.user import Claim, User
+from fediseer.consts import AUTH_CACHE_TTL, AUTH_CACHE_STATS_INTERVAL
+
+class AuthCache:
+    '''Caches API key authentications in the flask cache for the TTL.
+    Maps the hashed API key to the (user_id, instance_id) it belongs to.
+    When the flask cache is shared (e.g. redis), invalidate() removes an entry for all workers.
+    The session hooks below call it once a change to a user's API key or claims is committed
+    '''
+
+    def __init__(self, ttl, stats_interval):
+        self.ttl = ttl
+        self.stats_interval = stats_interval
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_cache_key(self, hashed_key):
+        return f"auth:{hashed_key}"
+
+    def get(self, hashed_key):
+        entry = cache.get(self.get_cache_key(hashed_key))
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            lookups = self.hits + self.misses
+        if lookups % self.stats_interval == 0:
+            self.log_stats()
+        if entry is None:
+            return None
+        return tuple(entry)
+
+    def set(self, hashed_key, user_id, instance_id):
+        cache.set(self.get_cache_key(hashed_key), (user_id, instance_id), timeout=self.ttl)
+
+    def invalidate(self, hashed_key):
+        cache.delete(self.get_cache_key(hashed_key))
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0,
+            }
+
+    def log_stats(self):
+        stats = self.get_stats()
+        logger.info(f"Auth cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_ratio']} hit ratio)")
+
+auth_cache = AuthCache(AUTH_CACHE_TTL, AUTH_CACHE_STATS_INTERVAL)
+
+# The hashed API keys whose cached authentication went stale in the current transaction.
+# This covers rotated keys, deleted users and added or removed claims, including those of deleted instances.
+# They are only invalidated once committed, so that no request can cache the old state again before the commit
+STALE_AUTH_KEYS_KEY = "stale_auth_keys"
+
+def queue_stale_auth_key(session, hashed_key):
+    session.info.setdefault(STALE_AUTH_KEYS_KEY, set()).add(hashed_key)
+
+@event.listens_for(User, "after_update")
+def queue_rotated_api_key(mapper, connection, target):
+    for hashed_key in inspect(target).attrs.api_key.history.deleted:
+        queue_stale_auth_key(object_session(target), hashed_key)
+
+@event.listens_for(User, "after_delete")
+def queue_deleted_user(mapper, connection, target):
+    queue_stale_auth_key(object_session(target), target.api_key)
+
+@event.listens_for(Claim, "after_insert")
+@event.listens_for(Claim, "after_delete")
+def queue_changed_claim(mapper, connection, target):
+    hashed_key = connection.execute(select(User.api_key).where(User.id == target.user_id)).scalar()
+    if hashed_key is not None:
+        queue_stale_auth_key(object_session(target), hashed_key)
+
+@event.listens_for(Session, "after_commit")
+def invalidate_stale_auth_keys(session):
+    for hashed_key in session.info.pop(STALE_AUTH_KEYS_KEY, set()):
+        auth_cache.invalidate(hashed_key)
+
+@event.listens_for(Session, "after_rollback")
+def discard_stale_auth_keys(session):
+    session.info.pop(STALE_AUTH_KEYS_KEY, None)
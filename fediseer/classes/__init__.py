@@ -4,6 +4,7 @@ from fediseer.argparser import args
 from importlib import import_module
 from fediseer.flask import db, OVERSEER
 from fediseer.utils import hash_api_key
+from fediseer.consts import FEDISEER_VERSION
 
 # Importing for DB creation
 from fediseer.classes.instance import Instance, Guarantee
@@ -24,6 +25,8 @@ with OVERSEER.app_context():
             open_registrations=False,
             email_verify=False,
             software="fediseer",
+            version=FEDISEER_VERSION,
+            chain_rooted=True,
         )
         admin_instance.create()
         guarantee = Guarantee(
@@ -47,4 +50,5 @@ with OVERSEER.app_context():
             instance_id = admin_instance.id
         )
         db.session.add(claim)
+        admin_instance.claims_count = 1
         db.session.commit()
\ No newline at end of file
@@ -108,14 +108,25 @@ class InstanceTag(db.Model):
     __tablename__ = "instance_tags"
     __table_args__ = (
         UniqueConstraint('instance_id', 'tag', name='instance_tags_instance_id_tag'),
-        Index("ix_tags_lower", func.lower('tag')),
+        # Serves the tag filters, which look up the instances having a tag
+        Index("ix_instance_tags_tag_norm_instance_id", "tag_norm", "instance_id"),
     )
     id = db.Column(db.Integer, primary_key=True)
     tag = db.Column(db.String(100), unique=False, nullable=False)
+    # The tag as produced by normalize_tag(), which all tag lookups use
+    tag_norm = db.Column(db.String(100), unique=False, nullable=False)
     instance_id = db.Column(db.Integer, db.ForeignKey("instances.id", ondelete="CASCADE"), nullable=False, index=True)
     instance = db.relationship("Instance", back_populates="tags")
     created = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
+class TagCount(db.Model):
+    '''How many instances use each tag, keyed by the normalized tag.
+    Maintained by adjust_tag_counts() whenever instance tags are added or removed
+    '''
+    __tablename__ = "tag_counts"
+    tag = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
 class Instance(db.Model):
     __tablename__ = "instances"
 
@@ -136,9 +147,22 @@ class Instance(db.Model):
     max_list_size = db.Column(db.Integer, unique=False, nullable=False, default=2000)
     pm_proxy = db.Column(Enum(enums.PMProxy), default=enums.PMProxy.NONE, nullable=False)
     poll_failures = db.Column(db.Integer, default=0, nullable=True)
+    # The last retrieved nodeinfo document and its cache validators, so that the updater can poll it conditionally
+    nodeinfo_url = db.Column(db.Text, unique=False, nullable=True)
+    nodeinfo_etag = db.Column(db.String(255), unique=False, nullable=True)
+    nodeinfo_last_modified = db.Column(db.String(64), unique=False, nullable=True)
     visibility_endorsements = db.Column(Enum(enums.ListVisibility), default=enums.ListVisibility.OPEN, nullable=False)
     visibility_censures = db.Column(Enum(enums.ListVisibility), default=enums.ListVisibility.OPEN, nullable=False)
     visibility_hesitations = db.Column(Enum(enums.ListVisibility), default=enums.ListVisibility.OPEN, nullable=False)
+    # Denormalized guarantee chain state. Maintained by database.refresh_chain_root() whenever a guarantee changes
+    chain_rooted = db.Column(db.Boolean, default=False, nullable=False, index=True)
+    chain_breaker_id = db.Column(db.Integer, unique=False, nullable=True)
+    # Denormalized relationship counters. Maintained by database.refresh_instance_counters() whenever the relationships change
+    endorsements_count = db.Column(db.Integer, default=0, nullable=False)
+    approvals_count = db.Column(db.Integer, default=0, nullable=False)
+    claims_count = db.Column(db.Integer, default=0, nullable=False)
+    censures_received_count = db.Column(db.Integer, default=0, nullable=False)
+    hesitations_received_count = db.Column(db.Integer, default=0, nullable=False)
 
     approvals = db.relationship("Endorsement", back_populates="approving_instance", cascade="all, delete-orphan", foreign_keys=[Endorsement.approving_id])
     endorsements = db.relationship("Endorsement", back_populates="endorsed_instance", cascade="all, delete-orphan", foreign_keys=[Endorsement.endorsed_id])
@@ -172,13 +196,13 @@ class Instance(db.Model):
             "domain": self.domain,
             "software": self.software,
             "version": self.version,
-            "claimed": len(self.admins),
+            "claimed": self.claims_count,
             "open_registrations": self.open_registrations,
             "email_verify": email_verification,
             "approval_required": self.approval_required,
             "has_captcha": self.has_captcha,
-            "endorsements": len(self.endorsements),
-            "approvals": len(self.approvals),
+            "endorsements": self.endorsements_count,
+            "approvals": self.approvals_count,
             "guarantor": self.get_guarantor_domain(),
             "sysadmins": self.sysadmins,
             "moderators": self.moderators,
@@ -236,6 +260,16 @@ class Instance(db.Model):
     def is_hesitating(self,instance):
         return instance in self.hesitations_given
 
+    def has_unbroken_chain(self):
+        if self.chain_rooted:
+            return True, None
+        chainbreaker = None
+        if self.chain_breaker_id is not None and self.chain_breaker_id != self.id:
+            chainbreaker = Instance.query.filter_by(id=self.chain_breaker_id).first()
+        if chainbreaker is None:
+            chainbreaker = self
+        return False, chainbreaker
+
     def get_state(self):
         if self.poll_failures == 0:
             return enums.InstanceState.UP
@@ -1,11 +1,17 @@
 from datetime import datetime
-from sqlalchemy import Enum
+from sqlalchemy import Enum, Index
 
 from fediseer.flask import db, SQLITE_MODE
 from fediseer import enums
 
 class Report(db.Model):
     __tablename__ = "reports"
+    __table_args__ = (
+        # Serves the per-domain activity lookups
+        Index("ix_reports_source_domain_created", "source_domain", "created"),
+        # Serves the keyset pagination of /reports
+        Index("ix_reports_created_id", "created", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     # We don't do relations as we don't care if the columns are linked
@@ -13,4 +19,18 @@ class Report(db.Model):
     target_domain = db.Column(db.String(255), unique=False, nullable=False, index=True)
     report_type = db.Column(Enum(enums.ReportType), nullable=False, index=True)
     report_activity = db.Column(Enum(enums.ReportActivity), nullable=False, index=True)
-    created = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
\ No newline at end of file
+    created = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class ReportArchive(db.Model):
+    '''Reports older than the retention period are moved here by archive_reports.py
+    so that the reports table only holds the recent activity
+    '''
+    __tablename__ = "reports_archive"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    source_domain = db.Column(db.String(255), unique=False, nullable=False, index=True)
+    target_domain = db.Column(db.String(255), unique=False, nullable=False, index=True)
+    report_type = db.Column(Enum(enums.ReportType), nullable=False, index=True)
+    report_activity = db.Column(Enum(enums.ReportActivity), nullable=False, index=True)
+    created = db.Column(db.DateTime, nullable=False, index=True)
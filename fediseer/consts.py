@@ -1,4 +1,4 @@
-FEDISEER_VERSION = "0.25.1"
+FEDISEER_VERSION = "0.26.0"
 SUPPORTED_SOFTWARE = {
     "lemmy",
     "mastodon",
@@ -15,4 +15,45 @@ POLLS_PER_DAY=2
 MAX_TAGS=100
 MAX_GUARANTEES=20
 MAX_GUARANTORS=1 #TODO: Not implemented yet
-MAX_CONFIG_ACTIONS_PER_MIN=20
\ No newline at end of file
+MAX_CONFIG_ACTIONS_PER_MIN=20
+INSTANCE_TOTALS_CACHE_SECONDS=600
+REGISTRATION_POLL_WORKERS=16
+BULK_WRITE_CHUNK_SIZE=1000
+AUTH_CACHE_TTL=60
+AUTH_CACHE_STATS_INTERVAL=1000
+ACTION_COUNTER_WINDOW=60
+REPORT_RETENTION_DAYS=90
+REPORT_ARCHIVE_BATCH_SIZE=5000
+SOLICITATIONS_CACHE_SECONDS=300
+ALL_INSTANCES_SNAPSHOT_SECONDS=3600
+SNAPSHOT_VERSIONS_KEPT=2
+EXPORT_BATCH_SIZE=500
+UPDATER_CONCURRENCY=100
+UPDATER_PER_HOST_CONCURRENCY=4
+HTTP_SESSION_POOL_SIZE=100
+HTTP_HOSTS_PER_SESSION=10
+HTTP_CONNECTIONS_PER_HOST=2
+HTTP_RETRIES=2
+HTTP_RETRY_BACKOFF=0.5
+# The longest we ever sleep between retries. Retry-After headers are not obeyed
+HTTP_RETRY_BACKOFF_MAX=5
+# Macros which can be used in reasons_csv filters to match any of their terms
+REASON_FILTER_MACROS = {
+    "__all_pedos__": [
+        "csam",
+        "loli",
+        "shota",
+        "pedophil",
+    ],
+    "__all_bigots__": [
+        "racism",
+        "sexism",
+        "transphobia",
+        "homophobia",
+        "islamophobia",
+        "nazi",
+        "fascist",
+        "hate speech",
+        "bigotry",
+    ],
+}
\ No newline at end of file
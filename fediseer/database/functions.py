@@ -1,12 +1,16 @@
+import time
 from loguru import logger
 from datetime import datetime, timedelta
-from sqlalchemy import func, or_, and_, not_, Boolean
-from fediseer.flask import db
-from fediseer.utils import hash_api_key
-from sqlalchemy.orm import joinedload
-from fediseer.classes.instance import Instance, Endorsement, Guarantee, RejectionRecord, Censure, Hesitation, Solicitation, InstanceFlag, InstanceTag, Rebuttal
+from sqlalchemy import func, or_, and_, not_, Boolean, select, text, case, insert, delete, event
+from fediseer.flask import db, cache, SQLITE_MODE
+from fediseer.utils import hash_api_key, normalize_tag
+from fediseer.authcache import auth_cache
+from fediseer.actioncounter import has_too_many_actions
+from sqlalchemy.orm import joinedload, selectinload, Session
+from sqlalchemy.dialects import postgresql, sqlite
+from fediseer.classes.instance import Instance, Endorsement, Guarantee, RejectionRecord, Censure, Hesitation, Solicitation, InstanceFlag, InstanceTag, TagCount, Rebuttal
 from fediseer.classes.user import Claim, User
-from fediseer.classes.reports import Report
+from fediseer.classes.reports import Report, ReportArchive
 from fediseer import enums, consts
 
 def get_all_instance_query(
@@ -15,34 +19,47 @@ def get_all_instance_query(
         tags = None,
         software = None,
         include_decommissioned = True,
+        tags_match = enums.TagsMatch.ANY,
     ):
+    # We avoid joining the relationships here, as that multiplies the rows per instance.
+    # Counts are filtered on the denormalized counters or on correlated subqueries instead
+    # and the collections needed for the details are loaded in separate batched queries.
     query = db.session.query(
         Instance
-    ).outerjoin(
-        Instance.endorsements,
-        Instance.guarantors,
     ).options(
-        joinedload(Instance.guarantors),
-        joinedload(Instance.endorsements),
-        joinedload(Instance.admins),
-        joinedload(Instance.guarantors),
-        joinedload(Instance.tags)
-    ).group_by(
-        Instance.id
+        selectinload(Instance.guarantors).selectinload(Guarantee.guarantor_instance),
+        selectinload(Instance.tags),
+        selectinload(Instance.flags),
     ).filter(
         or_(
             Instance.oprhan_since == None,
             Instance.oprhan_since > datetime.utcnow() - timedelta(hours=24)
         )
-    ).having(
-        db.func.count(Instance.endorsements) >= min_endorsements,
-    ).having(
-        db.func.count(Instance.guarantors) >= min_guarantors,
     )
+    if min_endorsements > 0:
+        query = query.filter(Instance.endorsements_count >= min_endorsements)
+    if min_guarantors > 0:
+        guarantors_count = select(
+            func.count(Guarantee.id)
+        ).where(
+            Guarantee.guaranteed_id == Instance.id
+        ).scalar_subquery()
+        query = query.filter(guarantors_count >= min_guarantors)
     if tags:
-        # Convert tags to lowercase and filter instances that have any of the tags
-        lower_tags = [tag.lower() for tag in tags]
-        query = query.filter(Instance.tags.any(func.lower(InstanceTag.tag).in_(lower_tags)))
+        # Filter instances that have any, or all, of the normalized tags
+        normalized_tags = {normalize_tag(tag) for tag in tags}
+        tagged_instance_ids = select(
+            InstanceTag.instance_id
+        ).where(
+            InstanceTag.tag_norm.in_(normalized_tags)
+        )
+        if tags_match == enums.TagsMatch.ALL:
+            tagged_instance_ids = tagged_instance_ids.group_by(
+                InstanceTag.instance_id
+            ).having(
+                func.count(InstanceTag.tag_norm.distinct()) == len(normalized_tags)
+            )
+        query = query.filter(Instance.id.in_(tagged_instance_ids))
     if software:
         lower_sw = [sw.lower() for sw in software]
         query = query.filter(Instance.software.in_(lower_sw))
@@ -56,56 +73,191 @@ def get_all_instances(
         include_decommissioned = True,
         page=1,
         limit=10,
+        cursor=None,
+        tags_match = enums.TagsMatch.ANY,
     ):
+    '''cursor is the (created, id) of the last instance of the previous page.
+    When provided, it takes precedence over page
+    '''
     query = get_all_instance_query(
         min_endorsements = min_endorsements, 
         min_guarantors = min_guarantors, 
         tags = tags,
         software = software,
         include_decommissioned = include_decommissioned,
-    )    
+        tags_match = tags_match,
+    ).order_by(
+        Instance.created.desc(),
+        Instance.id.desc(),
+    )
+    if limit is None:
+        return query.all()
+    if cursor is not None:
+        cursor_created, cursor_id = cursor
+        return query.filter(
+            or_(
+                Instance.created < cursor_created,
+                and_(
+                    Instance.created == cursor_created,
+                    Instance.id < cursor_id,
+                )
+            )
+        ).limit(limit).all()
     page -= 1
     if page < 0:
         page = 0
-    if limit is None:
-        return query.order_by(Instance.created.desc()).all()
-    return query.order_by(Instance.created.desc()).offset(limit * page).limit(limit).all()
+    return query.offset(limit * page).limit(limit).all()
 
-def count_all_instances(
+def stream_all_instances(
         min_endorsements = 0, 
         min_guarantors = 1, 
         tags = None,
         software = None,
         include_decommissioned = True,
+        tags_match = enums.TagsMatch.ANY,
     ):
+    '''Iterates over all instances matching these filters, in the same order as get_all_instances().
+    The rows are fetched from a server-side cursor in batches of EXPORT_BATCH_SIZE
+    so that the full result is never held in memory
+    '''
     query = get_all_instance_query(
         min_endorsements = min_endorsements, 
         min_guarantors = min_guarantors, 
         tags = tags,
         software = software,
         include_decommissioned = include_decommissioned,
-    )    
-    return query.count()
+        tags_match = tags_match,
+    ).order_by(
+        Instance.created.desc(),
+        Instance.id.desc(),
+    )
+    return query.yield_per(consts.EXPORT_BATCH_SIZE)
 
-def query_all_endorsed_instances_by_approving_id(approving_ids):
+def count_all_instances(
+        min_endorsements = 0, 
+        min_guarantors = 1, 
+        tags = None,
+        software = None,
+        include_decommissioned = True,
+        approximate = False,
+        tags_match = enums.TagsMatch.ANY,
+    ):
+    '''Counts the instances matching these filters.
+    The count is cached per filter combination until invalidate_instance_totals() is called
+    If approximate is True and no filters are applied, the database's row estimate is used instead
+    '''
+    filter_key = ":".join([
+        str(min_endorsements),
+        str(min_guarantors),
+        ",".join(sorted({normalize_tag(t) for t in tags})) if tags else "",
+        tags_match.name,
+        ",".join(sorted(s.lower() for s in software)) if software else "",
+        str(include_decommissioned),
+    ])
+    cache_key = f"instance_totals:{get_instance_totals_generation()}:{filter_key}"
+    total = cache.get(cache_key)
+    if total is not None:
+        return total
+    total = None
+    unfiltered = min_endorsements <= 0 and min_guarantors <= 0 and not tags and not software
+    if approximate and unfiltered and not SQLITE_MODE:
+        # reltuples is -1 when the table has never been analyzed
+        estimate = db.session.execute(
+            text("SELECT reltuples FROM pg_class WHERE relname = :table_name"),
+            {"table_name": Instance.__tablename__},
+        ).scalar()
+        if estimate is not None and estimate >= 0:
+            total = int(estimate)
+    if total is None:
+        query = get_all_instance_query(
+            min_endorsements = min_endorsements, 
+            min_guarantors = min_guarantors, 
+            tags = tags,
+            software = software,
+            include_decommissioned = include_decommissioned,
+            tags_match = tags_match,
+        )    
+        total = query.count()
+    cache.set(cache_key, total, timeout=consts.INSTANCE_TOTALS_CACHE_SECONDS)
+    return total
+
+def get_instance_totals_generation():
+    generation = cache.get("instance_totals_generation")
+    if generation is None:
+        # We start from the current time so that totals cached before an eviction of this key are not reused
+        generation = time.time_ns()
+        cache.set("instance_totals_generation", generation, timeout=0)
+    return generation
+
+def invalidate_instance_totals():
+    '''Discards all cached instance totals.
+    Has to be called whenever instances are added or a change affects which instances match the whitelist filters
+    '''
+    cache.set("instance_totals_generation", get_instance_totals_generation() + 1, timeout=0)
+
+# Changes made inside a transaction invalidate the totals once committed,
+# so that no request can cache a total from before the commit under the new generation
+INSTANCE_TOTALS_KEY = "invalidate_instance_totals"
+
+def invalidate_instance_totals_on_commit():
+    db.session.info[INSTANCE_TOTALS_KEY] = True
+
+@event.listens_for(Session, "after_commit")
+def invalidate_committed_instance_totals(session):
+    if session.info.pop(INSTANCE_TOTALS_KEY, False):
+        invalidate_instance_totals()
+
+@event.listens_for(Session, "after_rollback")
+def discard_instance_totals_invalidation(session):
+    session.info.pop(INSTANCE_TOTALS_KEY, None)
+
+def filter_by_reasons(grouped_query, reason_column, reasons, min_matches=1):
+    '''Keeps only the groups which have at least min_matches reasons containing one of the provided terms.
+    The terms are expected to be lowercase.
+    On postgres, the matching is served by the trigram indexes on the lowercase reasons
+    '''
+    lower_reason = func.lower(reason_column)
+    term_matches = [lower_reason.contains(term, autoescape=True) for term in reasons]
+    grouped_query = grouped_query.filter(or_(*term_matches))
+    if min_matches > 1:
+        grouped_query = grouped_query.having(
+            or_(*[func.sum(case((term_match, 1), else_=0)) >= min_matches for term_match in term_matches])
+        )
+    return grouped_query
+
+def query_all_endorsed_instances_by_approving_id(approving_ids, min_endorsements=1, reasons=None):
+    '''If reasons are provided, only instances which have at least min_endorsements reasons containing the same term are returned'''
+    # The targets are aggregated separately, so that each instance is only returned once
+    target_ids = db.session.query(
+        Endorsement.endorsed_id
+    ).filter(
+        Endorsement.approving_id.in_(approving_ids)
+    ).group_by(
+        Endorsement.endorsed_id
+    )
+    if reasons:
+        target_ids = filter_by_reasons(target_ids, Endorsement.reason, reasons, min_endorsements)
+    elif min_endorsements > 1:
+        target_ids = target_ids.having(func.count(func.distinct(Endorsement.approving_id)) >= min_endorsements)
     return db.session.query(
         Instance
-    ).outerjoin(
-        Instance.endorsements,
     ).options(
-        joinedload(Instance.endorsements),
+        selectinload(Instance.guarantors).selectinload(Guarantee.guarantor_instance),
     ).filter(
-        Endorsement.approving_id.in_(approving_ids)
-    ).group_by(
-        Instance.id
+        Instance.id.in_(target_ids)
     )
 
-def count_all_endorsed_instances_by_approving_id(approving_ids):
-    query = query_all_endorsed_instances_by_approving_id(approving_ids)
+def count_all_endorsed_instances_by_approving_id(approving_ids, min_endorsements=1, reasons=None):
+    query = query_all_endorsed_instances_by_approving_id(approving_ids, min_endorsements, reasons)
     return query.count()
 
-def get_all_endorsed_instances_by_approving_id(approving_ids,page=1,limit=100):
-    query = query_all_endorsed_instances_by_approving_id(approving_ids)
+def get_all_endorsed_instances_by_approving_id(approving_ids,page=1,limit=100,cursor=None,min_endorsements=1,reasons=None):
+    '''cursor is the domain of the last instance of the previous page.
+    When provided, it takes precedence over page
+    '''
+    query = query_all_endorsed_instances_by_approving_id(approving_ids, min_endorsements, reasons)
+    if limit is not None and cursor is not None:
+        return query.filter(Instance.domain > cursor).order_by(Instance.domain).limit(limit).all()
     if limit is not None:
         page -= 1
         if page < 0:
@@ -115,19 +267,18 @@ def get_all_endorsed_instances_by_approving_id(approving_ids,page=1,limit=100):
         return query.all()
 
 def get_all_approving_instances_by_endorsed_id(endorsed_id):
+    approving_ids = db.session.query(
+        Endorsement.approving_id
+    ).filter(
+        Endorsement.endorsed_id == endorsed_id
+    )
     query = db.session.query(
         Instance
-    ).outerjoin(
-        Instance.approvals,
     ).options(
-        joinedload(Instance.approvals),
-        joinedload(Instance.endorsements),
-        joinedload(Instance.admins),
-        joinedload(Instance.guarantors)
+        selectinload(Instance.approvals),
+        selectinload(Instance.guarantors).selectinload(Guarantee.guarantor_instance),
     ).filter(
-        Endorsement.endorsed_id == endorsed_id
-    ).group_by(
-        Instance.id
+        Instance.id.in_(approving_ids)
     )
     return query.all()
 
@@ -136,41 +287,60 @@ def get_all_endorsement_reasons_for_endorsed_id(endorsed_id, approving_ids):
         Endorsement.endorsed_id == endorsed_id,
         Endorsement.approving_id.in_(approving_ids),
     ).with_entities(
+        Endorsement.approving_id,
         Endorsement.reason,
     )
     return query.all()
 
-def get_all_endorsements_from_approving_id(approving_ids):
+def get_all_endorsements_from_approving_id(approving_ids, endorsed_ids=None):
     query = Endorsement.query.filter(
         Endorsement.approving_id.in_(approving_ids)
     )
+    if endorsed_ids is not None:
+        query = query.filter(Endorsement.endorsed_id.in_(endorsed_ids))
     return query.all()
 
+def count_all_endorsements_from_approving_id(approving_ids):
+    query = Endorsement.query.filter(
+        Endorsement.approving_id.in_(approving_ids)
+    )
+    return query.count()
+
 
 
-def query_all_censured_instances_by_censuring_id(censuring_ids):
+def query_all_censured_instances_by_censuring_id(censuring_ids, min_censures=1, reasons=None):
+    '''If reasons are provided, only instances which have at least min_censures reasons containing the same term are returned'''
+    # The targets are aggregated separately, so that each instance is only returned once
+    target_ids = db.session.query(
+        Censure.censured_id
+    ).filter(
+        Censure.censuring_id.in_(censuring_ids)
+    ).group_by(
+        Censure.censured_id
+    )
+    if reasons:
+        target_ids = filter_by_reasons(target_ids, Censure.reason, reasons, min_censures)
+    elif min_censures > 1:
+        target_ids = target_ids.having(func.count(func.distinct(Censure.censuring_id)) >= min_censures)
     return db.session.query(
         Instance
-    ).outerjoin(
-        Instance.censures_received,
     ).options(
-        joinedload(Instance.censures_received),
-        joinedload(Instance.endorsements),
-        joinedload(Instance.approvals),
-        joinedload(Instance.admins),
-        joinedload(Instance.guarantors)
+        selectinload(Instance.guarantors).selectinload(Guarantee.guarantor_instance),
     ).filter(
-        Censure.censuring_id.in_(censuring_ids)
-    ).group_by(
-        Instance.id
+        Instance.id.in_(target_ids)
     )
 
-def count_all_censured_instances_by_censuring_id(censuring_ids):
-    query = query_all_censured_instances_by_censuring_id(censuring_ids)
+def count_all_censured_instances_by_censuring_id(censuring_ids, min_censures=1, reasons=None):
+    query = query_all_censured_instances_by_censuring_id(censuring_ids, min_censures, reasons)
     return query.count()
 
-def get_all_censured_instances_by_censuring_id(censuring_ids,page=1,limit=100):
-    query = query_all_censured_instances_by_censuring_id(censuring_ids)
+def get_all_censured_instances_by_censuring_id(censuring_ids,page=1,limit=100,cursor=None,min_censures=1,reasons=None):
+    '''cursor is the domain of the last instance of the previous page.
+    When provided, it takes precedence over page
+    '''
+    query = query_all_censured_instances_by_censuring_id(censuring_ids, min_censures, reasons)
+    if limit is not None and cursor is not None:
+        return query.filter(Instance.domain > cursor).order_by(Instance.domain).limit(limit).all()
     if limit is not None:
         page -= 1
         if page < 0:
@@ -180,16 +350,18 @@ def get_all_censured_instances_by_censuring_id(censuring_ids,page=1,limit=100):
         return query.all()
 
 def get_all_censuring_instances_by_censured_id(censured_id):
+    censuring_ids = db.session.query(
+        Censure.censuring_id
+    ).filter(
+        Censure.censured_id == censured_id
+    )
     query = db.session.query(
         Instance
-    ).outerjoin(
-        Instance.censures_given,
     ).options(
-        joinedload(Instance.censures_given),
+        selectinload(Instance.censures_given),
+        selectinload(Instance.guarantors).selectinload(Guarantee.guarantor_instance),
     ).filter(
-        Censure.censured_id == censured_id
-    ).group_by(
-        Instance.id
+        Instance.id.in_(censuring_ids)
     )
     return query.all()
 
@@ -204,36 +376,54 @@ def get_all_censure_reasons_for_censured_id(censured_id, censuring_ids):
     )
     return query.all()
 
-def get_all_censures_from_censuring_id(censuring_ids):
+def get_all_censures_from_censuring_id(censuring_ids, censured_ids=None):
     query = Censure.query.filter(
         Censure.censuring_id.in_(censuring_ids)
     )
+    if censured_ids is not None:
+        query = query.filter(Censure.censured_id.in_(censured_ids))
     return query.all()
 
+def count_all_censures_from_censuring_id(censuring_ids):
+    query = Censure.query.filter(
+        Censure.censuring_id.in_(censuring_ids)
+    )
+    return query.count()
+
 
-def query_all_dubious_instances_by_hesitant_id(hesitant_ids):
+def query_all_dubious_instances_by_hesitant_id(hesitant_ids, min_hesitations=1, reasons=None):
+    '''If reasons are provided, only instances which have at least min_hesitations reasons containing the same term are returned'''
+    # The targets are aggregated separately, so that each instance is only returned once
+    target_ids = db.session.query(
+        Hesitation.dubious_id
+    ).filter(
+        Hesitation.hesitant_id.in_(hesitant_ids)
+    ).group_by(
+        Hesitation.dubious_id
+    )
+    if reasons:
+        target_ids = filter_by_reasons(target_ids, Hesitation.reason, reasons, min_hesitations)
+    elif min_hesitations > 1:
+        target_ids = target_ids.having(func.count(func.distinct(Hesitation.hesitant_id)) >= min_hesitations)
     return db.session.query(
         Instance
-    ).outerjoin(
-        Instance.hesitations_received,
     ).options(
-        joinedload(Instance.hesitations_received),
-        joinedload(Instance.endorsements),
-        joinedload(Instance.approvals),
-        joinedload(Instance.admins),
-        joinedload(Instance.guarantors)
+        selectinload(Instance.guarantors).selectinload(Guarantee.guarantor_instance),
     ).filter(
-        Hesitation.hesitant_id.in_(hesitant_ids)
-    ).group_by(
-        Instance.id
+        Instance.id.in_(target_ids)
     )
 
-def count_all_dubious_instances_by_hesitant_id(hesitant_ids):
-    query = query_all_dubious_instances_by_hesitant_id(hesitant_ids)
+def count_all_dubious_instances_by_hesitant_id(hesitant_ids, min_hesitations=1, reasons=None):
+    query = query_all_dubious_instances_by_hesitant_id(hesitant_ids, min_hesitations, reasons)
     return query.count()
 
-def get_all_dubious_instances_by_hesitant_id(hesitant_ids,page=1,limit=100):
-    query = query_all_dubious_instances_by_hesitant_id(hesitant_ids)
+def get_all_dubious_instances_by_hesitant_id(hesitant_ids,page=1,limit=100,cursor=None,min_hesitations=1,reasons=None):
+    '''cursor is the domain of the last instance of the previous page.
+    When provided, it takes precedence over page
+    '''
+    query = query_all_dubious_instances_by_hesitant_id(hesitant_ids, min_hesitations, reasons)
+    if limit is not None and cursor is not None:
+        return query.filter(Instance.domain > cursor).order_by(Instance.domain).limit(limit).all()
     if limit is not None:
         page -= 1
         if page < 0:
@@ -243,16 +433,18 @@ def get_all_dubious_instances_by_hesitant_id(hesitant_ids,page=1,limit=100):
         return query.all()
 
 def get_all_hesitant_instances_by_dubious_id(dubious_id):
+    hesitant_ids = db.session.query(
+        Hesitation.hesitant_id
+    ).filter(
+        Hesitation.dubious_id == dubious_id
+    )
     query = db.session.query(
         Instance
-    ).outerjoin(
-        Instance.hesitations_given,
     ).options(
-        joinedload(Instance.hesitations_given),
+        selectinload(Instance.hesitations_given),
+        selectinload(Instance.guarantors).selectinload(Guarantee.guarantor_instance),
     ).filter(
-        Hesitation.dubious_id == dubious_id
-    ).group_by(
-        Instance.id
+        Instance.id.in_(hesitant_ids)
     )
     return query.all()
 
@@ -267,12 +459,72 @@ def get_all_hesitation_reasons_for_dubious_id(dubious_id, hesitant_ids):
     )
     return query.all()
 
-def get_all_hesitations_from_hesitant_id(hesitant_ids):
+def get_all_hesitations_from_hesitant_id(hesitant_ids, dubious_ids=None):
     query = Hesitation.query.filter(
         Hesitation.hesitant_id.in_(hesitant_ids)
     )
+    if dubious_ids is not None:
+        query = query.filter(Hesitation.dubious_id.in_(dubious_ids))
     return query.all()
 
+def count_all_hesitations_from_hesitant_id(hesitant_ids):
+    query = Hesitation.query.filter(
+        Hesitation.hesitant_id.in_(hesitant_ids)
+    )
+    return query.count()
+
+def bulk_upsert(model, rows, index_elements, update_columns):
+    '''Inserts the rows, updating the update_columns of the rows which already exist on index_elements.
+    Sends one INSERT ... ON CONFLICT DO UPDATE statement per chunk of rows.
+    '''
+    dialect = sqlite if SQLITE_MODE else postgresql
+    for chunk_start in range(0, len(rows), consts.BULK_WRITE_CHUNK_SIZE):
+        statement = dialect.insert(model).values(rows[chunk_start:chunk_start + consts.BULK_WRITE_CHUNK_SIZE])
+        statement = statement.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={column: statement.excluded[column] for column in update_columns},
+        )
+        db.session.execute(statement)
+
+def upsert_endorsements(approving_id, entries):
+    '''entries is a list of dicts with the endorsed_id and reason'''
+    rows = [dict(entry, approving_id=approving_id) for entry in entries]
+    bulk_upsert(Endorsement, rows, ["approving_id", "endorsed_id"], ["reason"])
+
+def delete_endorsements(approving_id, endorsed_ids):
+    if len(endorsed_ids) == 0:
+        return 0
+    return Endorsement.query.filter(
+        Endorsement.approving_id == approving_id,
+        Endorsement.endorsed_id.in_(endorsed_ids),
+    ).delete(synchronize_session=False)
+
+def upsert_censures(censuring_id, entries):
+    '''entries is a list of dicts with the censured_id, reason and evidence'''
+    rows = [dict(entry, censuring_id=censuring_id) for entry in entries]
+    bulk_upsert(Censure, rows, ["censuring_id", "censured_id"], ["reason", "evidence"])
+
+def delete_censures(censuring_id, censured_ids):
+    if len(censured_ids) == 0:
+        return 0
+    return Censure.query.filter(
+        Censure.censuring_id == censuring_id,
+        Censure.censured_id.in_(censured_ids),
+    ).delete(synchronize_session=False)
+
+def upsert_hesitations(hesitant_id, entries):
+    '''entries is a list of dicts with the dubious_id, reason and evidence'''
+    rows = [dict(entry, hesitant_id=hesitant_id) for entry in entries]
+    bulk_upsert(Hesitation, rows, ["hesitant_id", "dubious_id"], ["reason", "evidence"])
+
+def delete_hesitations(hesitant_id, dubious_ids):
+    if len(dubious_ids) == 0:
+        return 0
+    return Hesitation.query.filter(
+        Hesitation.hesitant_id == hesitant_id,
+        Hesitation.dubious_id.in_(dubious_ids),
+    ).delete(synchronize_session=False)
+
 def get_rebuttal(target_instance_id, source_instance_id):
     query = Rebuttal.query.filter_by(
         target_id=target_instance_id,
@@ -320,15 +572,32 @@ def get_all_guarantor_instances_by_guaranteed_id(guaranteed_id):
     return query.all()
 
 
-def find_instance_by_api_key(api_key):
-    instance = Instance.query.join(
+def authenticate_api_key(api_key):
+    '''Returns the (user_id, instance_id) the API key belongs to, or None if it doesn't match any user.
+    Authentications are cached, and the auth_cache drops them once a change to the user's API key or claims is committed
+    '''
+    hashed_key = hash_api_key(api_key)
+    cached = auth_cache.get(hashed_key)
+    if cached is not None:
+        return cached
+    result = db.session.query(
+        User.id,
+        Claim.instance_id,
+    ).outerjoin(
         Claim
-    ).join(
-        User
     ).filter(
-        User.api_key == hash_api_key(api_key)
+        User.api_key == hashed_key
     ).first()
-    return instance
+    if result is None:
+        return None
+    auth_cache.set(hashed_key, result.id, result.instance_id)
+    return result.id, result.instance_id
+
+def find_instance_by_api_key(api_key):
+    authentication = authenticate_api_key(api_key)
+    if authentication is None or authentication[1] is None:
+        return None
+    return Instance.query.get(authentication[1])
 
 def find_instance_by_user(user):
     instance = Instance.query.join(
@@ -369,10 +638,10 @@ def find_claim(admin_username):
     return claim
 
 def find_user_by_api_key(api_key):
-    user = User.query.filter(
-        User.api_key == hash_api_key(api_key)
-    ).first()
-    return user
+    authentication = authenticate_api_key(api_key)
+    if authentication is None:
+        return None
+    return User.query.get(authentication[0])
 
 def find_user_by_account(user_account):
     user = User.query.filter(
@@ -459,18 +728,47 @@ def get_guarantee(instance_id, guarantor_id):
     return query.first()
 
 def get_guarantor_chain(instance_id):
-    guarantors = set()
-    chainbreaker = None
-    query = Guarantee.query.filter_by(
-        guaranteed_id=instance_id,
+    # We walk up the whole chain in a single recursive query
+    # The fediseer instance (id 0) guarantees for itself, so we stop climbing once we reach it
+    chain = db.session.query(
+        Guarantee.guarantor_id,
+        Guarantee.guaranteed_id,
+    ).filter(
+        Guarantee.guaranteed_id == instance_id,
+    ).cte(
+        name="guarantor_chain",
+        recursive=True,
+    )
+    chain = chain.union(
+        db.session.query(
+            Guarantee.guarantor_id,
+            Guarantee.guaranteed_id,
+        ).join(
+            chain,
+            Guarantee.guaranteed_id == chain.c.guarantor_id,
+        ).filter(
+            chain.c.guarantor_id != 0
+        )
     )
-    guarantor = query.first()
-    if not guarantor:
+    links = db.session.query(chain.c.guarantor_id, chain.c.guaranteed_id).all()
+    if not links:
         return set(),instance_id
-    guarantors.add(guarantor.guarantor_id)
-    if guarantor.guarantor_id != 0:
-        higher_guarantors, chainbreaker = get_guarantor_chain(guarantor.guarantor_id)
-        guarantors = higher_guarantors | guarantors
+    guarantors = set([l.guarantor_id for l in links])
+    if 0 in guarantors:
+        return guarantors,None
+    guaranteed = set([l.guaranteed_id for l in links])
+    # The chain breaker is the topmost guarantor which has no guarantor of its own
+    chainbreaker = next(iter(guarantors - guaranteed), None)
+    if chainbreaker is None:
+        # Every guarantor is guaranteed in turn, so the chain ends in a guarantee loop which never reaches the fediseer.
+        # Like rebuild_chain_roots(), we blame the lowest id of the loop
+        guarantor_links = {l.guaranteed_id: l.guarantor_id for l in links}
+        path = []
+        current_id = instance_id
+        while current_id not in path:
+            path.append(current_id)
+            current_id = guarantor_links[current_id]
+        chainbreaker = min(path[path.index(current_id):])
     return guarantors,chainbreaker
 
 def has_unbroken_chain(instance_id):
@@ -480,16 +778,103 @@ def has_unbroken_chain(instance_id):
     return 0 in guarantors,chainbreaker
 
 def get_guarantee_chain(instance_id):
-    query = Guarantee.query.filter_by(
-        guarantor_id=instance_id,
+    # Walks down the whole subtree of guarantees in a single recursive query
+    chain = db.session.query(
+        Guarantee.guaranteed_id,
+    ).filter(
+        Guarantee.guarantor_id == instance_id,
+    ).cte(
+        name="guarantee_chain",
+        recursive=True,
+    )
+    chain = chain.union(
+        db.session.query(
+            Guarantee.guaranteed_id,
+        ).join(
+            chain,
+            Guarantee.guarantor_id == chain.c.guaranteed_id,
+        )
+    )
+    return set([row.guaranteed_id for row in db.session.query(chain.c.guaranteed_id).all()])
+
+def refresh_chain_root(instance_id):
+    '''Recalculates the stored chain state for an instance and all instances it guarantees for.
+    Has to be called whenever a guarantee of this instance is added or removed.
+    '''
+    guarantors, chainbreaker = get_guarantor_chain(instance_id)
+    chain_rooted = 0 in guarantors
+    affected_ids = get_guarantee_chain(instance_id)
+    affected_ids.add(instance_id)
+    Instance.query.filter(
+        Instance.id.in_(affected_ids)
+    ).update(
+        {
+            Instance.chain_rooted: chain_rooted,
+            Instance.chain_breaker_id: None if chain_rooted else chainbreaker,
+        },
+        synchronize_session="evaluate",
+    )
+    invalidate_instance_totals_on_commit()
+    return affected_ids
+
+def rebuild_chain_roots():
+    '''Rebuilds the stored chain state of all instances from scratch.
+    Returns the amount of instances which had to be corrected.
+    '''
+    guarantor_links = dict(db.session.query(Guarantee.guaranteed_id, Guarantee.guarantor_id).all())
+    chain_states = {0: (True, None)}
+    for instance_id in guarantor_links.keys():
+        path = []
+        current_id = instance_id
+        while current_id not in chain_states:
+            if current_id in path:
+                # A guarantee loop which never reaches the fediseer. We blame its lowest id, same as get_guarantor_chain()
+                chain_states[current_id] = (False, min(path[path.index(current_id):]))
+                break
+            path.append(current_id)
+            if current_id not in guarantor_links:
+                chain_states[current_id] = (False, current_id)
+                break
+            current_id = guarantor_links[current_id]
+        for path_id in path:
+            if path_id not in chain_states:
+                chain_states[path_id] = chain_states[current_id]
+    mappings = []
+    for instance_id, chain_rooted, chain_breaker_id in db.session.query(Instance.id, Instance.chain_rooted, Instance.chain_breaker_id).all():
+        expected_rooted, expected_breaker_id = chain_states.get(instance_id, (False, instance_id))
+        if chain_rooted != expected_rooted or chain_breaker_id != expected_breaker_id:
+            mappings.append({
+                "id": instance_id,
+                "chain_rooted": expected_rooted,
+                "chain_breaker_id": expected_breaker_id,
+            })
+    if mappings:
+        db.session.bulk_update_mappings(Instance, mappings)
+        db.session.commit()
+        invalidate_instance_totals()
+    return len(mappings)
+
+def refresh_instance_counters(instance_ids=None):
+    '''Recounts the denormalized relationship counters of the given instances.
+    Has to be called whenever endorsements, censures, hesitations or claims are added or removed.
+    If no instance_ids are provided, all instances are recounted.
+    '''
+    # Ensure pending additions and deletions are counted
+    db.session.flush()
+    invalidate_instance_totals_on_commit()
+    query = Instance.query
+    if instance_ids is not None:
+        query = query.filter(Instance.id.in_(set(instance_ids)))
+    return query.update(
+        {
+            Instance.endorsements_count: select(func.count(Endorsement.id)).where(Endorsement.endorsed_id == Instance.id).scalar_subquery(),
+            Instance.approvals_count: select(func.count(Endorsement.id)).where(Endorsement.approving_id == Instance.id).scalar_subquery(),
+            Instance.claims_count: select(func.count(Claim.id)).where(Claim.instance_id == Instance.id).scalar_subquery(),
+            Instance.censures_received_count: select(func.count(Censure.id)).where(Censure.censured_id == Instance.id).scalar_subquery(),
+            Instance.hesitations_received_count: select(func.count(Hesitation.id)).where(Hesitation.dubious_id == Instance.id).scalar_subquery(),
+        },
+        synchronize_session="evaluate",
     )
-    guarantees = query.all()
-    if not guarantees:
-        return set()
-    guarantees_ids = set([g.guaranteed_id for g in guarantees])
-    for gid in guarantees_ids:
-        guarantees_ids = guarantees_ids | get_guarantee_chain(gid)
-    return guarantees_ids
 
 def get_instances_by_ids(instance_ids):
     query = Instance.query.filter(
@@ -503,7 +888,12 @@ def get_reports(
         report_type: enums.ReportType = None,
         report_activity: enums.ReportActivity = None,
         page: int = 1,
+        limit: int = 10,
+        cursor: tuple = None,
     ):
+    '''cursor is the (created, id) of the last report of the previous page.
+    When provided, it takes precedence over page
+    '''
     query = Report.query
     if source_instances is not None and len(source_instances) > 0:
         query = query.filter(Report.source_domain.in_(source_instances)
@@ -517,29 +907,90 @@ def get_reports(
     if report_activity is not None:
         query = query.filter(Report.report_activity == report_activity.name
     )
-
+    query = query.order_by(Report.created.desc(), Report.id.desc())
+    if cursor is not None:
+        cursor_created, cursor_id = cursor
+        return query.filter(
+            or_(
+                Report.created < cursor_created,
+                and_(
+                    Report.created == cursor_created,
+                    Report.id < cursor_id,
+                )
+            )
+        ).limit(limit).all()
     page -= 1
     if page < 0:
         page = 0
-    return query.order_by(Report.created.desc()).offset(10 * page).limit(10).all()
+    return query.offset(limit * page).limit(limit).all()
+
+def archive_reports(older_than, batch_size=consts.REPORT_ARCHIVE_BATCH_SIZE):
+    '''Moves the reports created before older_than into the reports archive.
+    Works in batches, committing after each one, so that the tables are not locked for long
+    Returns the amount of archived reports
+    '''
+    columns = ["id", "source_domain", "target_domain", "report_type", "report_activity", "created"]
+    archived = 0
+    while True:
+        batch_ids = [
+            row.id for row in db.session.query(Report.id).filter(
+                Report.created < older_than
+            ).order_by(Report.id).limit(batch_size)
+        ]
+        if len(batch_ids) == 0:
+            break
+        db.session.execute(
+            insert(ReportArchive).from_select(
+                columns,
+                select(*[getattr(Report, c) for c in columns]).where(Report.id.in_(batch_ids))
+            )
+        )
+        db.session.execute(delete(Report).where(Report.id.in_(batch_ids)))
+        db.session.commit()
+        archived += len(batch_ids)
+    return archived
+
+def purge_archived_reports(older_than):
+    '''Deletes the archived reports created before older_than. Returns the amount of deleted reports'''
+    deleted = db.session.execute(delete(ReportArchive).where(ReportArchive.created < older_than)).rowcount
+    db.session.commit()
+    return deleted
 
 
+SOLICITATIONS_CACHE_KEY = "solicitations"
+
 def get_all_solicitations():
-    # Subquery to find the minimum created date for each source_instance
+    '''Returns (Instance, oldest_solicitation_date, latest_comment) for each soliciting instance
+    ordered by their oldest solicitation
+    '''
+    # Window functions give us the oldest date and the latest comment of each source_instance
+    # on the row of its latest solicitation, so we can keep just that row
     subq = db.session.query(
         Solicitation.source_id,
-        func.min(Solicitation.created).label('oldest_solicitation_date')
-    ).group_by(
-        Solicitation.source_id
+        Solicitation.comment.label('latest_comment'),
+        func.min(Solicitation.created).over(
+            partition_by=Solicitation.source_id
+        ).label('oldest_solicitation_date'),
+        func.row_number().over(
+            partition_by=Solicitation.source_id,
+            order_by=(Solicitation.created.desc(), Solicitation.id.desc()),
+        ).label('recency'),
     ).subquery()
 
     # Query to retrieve instances with at least one solicitation
     query = db.session.query(
         Instance,
+        subq.c.oldest_solicitation_date,
+        subq.c.latest_comment,
     ).join(
         subq,
         Instance.id == subq.c.source_id
+    ).options(
+        selectinload(Instance.guarantors).selectinload(Guarantee.guarantor_instance),
+        selectinload(Instance.tags),
+        selectinload(Instance.flags),
     ).filter(
+        subq.c.recency == 1,
         # We do not show offline instances for solicitation
         Instance.poll_failures < enums.InstanceState.OFFLINE.value
     ).order_by(
@@ -548,6 +999,12 @@ def get_all_solicitations():
     
     return query.all()
 
+def invalidate_solicitations():
+    '''Discards the cached solicitations list.
+    Has to be called after solicitations are added or removed have been committed
+    '''
+    cache.delete(SOLICITATIONS_CACHE_KEY)
+
 def find_solicitation_by_target(source_id, target_id):
     query = db.session.query(
         Solicitation
@@ -583,12 +1040,9 @@ def find_latest_solicitation_by_source(source_id):
     return query.order_by(Solicitation.created.desc()).first()
 
 def has_too_many_actions_per_min(source_domain):
-    query = Report.query.filter_by(
-        source_domain=source_domain
-    ).filter(
-        Report.created > datetime.utcnow() - timedelta(minutes=1),
-    )
-    return query.count() > consts.MAX_CONFIG_ACTIONS_PER_MIN
+    # Counted by the action counter configured in FEDISEER_ACTION_COUNTER.
+    # Set it to 'database' to count the reports table instead.
+    return has_too_many_actions(source_domain)
 
 def get_instance_flag(instance_id, flag_enum):
     query = InstanceFlag.query.filter(
@@ -604,19 +1058,20 @@ def instance_has_flag(instance_id, flag_enum):
     )
     return query.count() == 1
 
-def get_instance_tag(instance_id, tag: str):
+def get_instance_tags(instance_id, tag: str):
+    '''Returns every tag of the instance which normalizes to the same tag, as older tags can differ only in case'''
     query = InstanceTag.query.filter(
         InstanceTag.instance_id == instance_id,
-        InstanceTag.tag == tag,
+        InstanceTag.tag_norm == normalize_tag(tag),
     )
-    return query.first()
+    return query.all()
 
 def instance_has_tag(instance_id, tag: str):
     query = InstanceTag.query.filter(
         InstanceTag.instance_id == instance_id,
-        InstanceTag.tag == tag.lower(),
+        InstanceTag.tag_norm == normalize_tag(tag),
     )
-    return query.count() == 1
+    return query.count() > 0
 
 def count_instance_tags(instance_id):
     query = InstanceTag.query.filter(
@@ -625,12 +1080,41 @@ def count_instance_tags(instance_id):
     return query.count()
 
 def get_tag_counts():
-    query = db.session.query(
-        func.lower(InstanceTag.tag).label('tag'),
-        func.count().label('tag_count')
-    ).group_by(InstanceTag.tag)
-
-    result = query.all()
-
-    tag_counts = {row.tag: row.tag_count for row in result}
-    return tag_counts
\ No newline at end of file
+    query = TagCount.query.filter(
+        TagCount.count > 0
+    ).order_by(TagCount.tag)
+    return {row.tag: row.count for row in query.all()}
+
+def adjust_tag_counts(tag_deltas):
+    '''tag_deltas maps tags to how many times they were added, or removed if negative.
+    Tags are merged on their normalized form
+    '''
+    merged_deltas = {}
+    for tag, delta in tag_deltas.items():
+        tag = normalize_tag(tag)
+        merged_deltas[tag] = merged_deltas.get(tag, 0) + delta
+    # Sorted so that concurrent adjustments lock the rows in the same order
+    rows = [{"tag": tag, "count": delta} for tag, delta in sorted(merged_deltas.items()) if delta != 0]
+    if len(rows) == 0:
+        return
+    dialect = sqlite if SQLITE_MODE else postgresql
+    statement = dialect.insert(TagCount).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=["tag"],
+        set_={"count": TagCount.count + statement.excluded["count"]},
+    )
+    db.session.execute(statement)
+    TagCount.query.filter(TagCount.count <= 0).delete(synchronize_session=False)
+
+def rebuild_tag_counts():
+    '''Recounts how many instances have each tag from the instance tags. Returns the amount of distinct tags.
+    Older tags can differ only in case within the same instance, so instances are counted once per normalized tag
+    '''
+    TagCount.query.delete(synchronize_session=False)
+    db.session.execute(
+        insert(TagCount).from_select(
+            ["tag", "count"],
+            select(InstanceTag.tag_norm, func.count(InstanceTag.instance_id.distinct())).group_by(InstanceTag.tag_norm)
+        )
+    )
+    return TagCount.query.count()
\ No newline at end of file
@@ -37,3 +37,7 @@ class InstanceFlags(enum.Enum):
 class BadgeStyle(enum.Enum):
     FULL = 0
     ICON = 1
+
+class TagsMatch(enum.Enum):
+    ANY = 0
+    ALL = 1
@@ -19,13 +19,25 @@ class InstanceInfo():
     has_captcha = None
     _allow_unreachable = False
     _req_timeout = 5
+    nodeinfo_url = None
+    nodeinfo_etag = None
+    nodeinfo_last_modified = None
+    # Set when the nodeinfo was requested conditionally and has not changed. node_info is not retrieved then
+    nodeinfo_unchanged = False
     _nodeinfo_err: Exception = None
     _siteinfo_err: Exception = None
+    # A requests.Session, or the requests module itself when no session is provided
+    _session = requests
 
-    def __init__(self, domain, allow_unreachable=False, req_timeout=5):
+    def __init__(self, domain, allow_unreachable=False, req_timeout=5, session=None, nodeinfo_url=None, nodeinfo_etag=None, nodeinfo_last_modified=None):
+        '''If the nodeinfo_url of a previous retrieval is provided, the nodeinfo is requested from it directly.
+        If its validators are provided as well, the nodeinfo is requested conditionally
+        '''
         self.domain = domain.lower()
         self._allow_unreachable = allow_unreachable
         self._req_timeout = req_timeout
+        if session is not None:
+            self._session = session
         if domain.endswith("test.dbzer0.com"):
             # Fake instances for testing chain of trust
             self.open_registrations = False
@@ -51,10 +63,52 @@ class InstanceInfo():
             return
 
         try:
-            self.node_info = InstanceInfo.get_nodeinfo(domain,req_timeout=self._req_timeout)
+            self.retrieve_nodeinfo(nodeinfo_url, nodeinfo_etag, nodeinfo_last_modified)
         except Exception as err:
             self._nodeinfo_err = err
 
+    def retrieve_nodeinfo(self, known_url=None, known_etag=None, known_last_modified=None):
+        nodeinfo = None
+        if known_url is not None:
+            # The nodeinfo is usually still where we last found it, which saves the discovery round trip
+            headers = InstanceInfo.get_nodeinfo_headers()
+            headers["Sec-Fetch-Site"] = "cross-site"
+            if known_etag:
+                headers["If-None-Match"] = known_etag
+            if known_last_modified:
+                headers["If-Modified-Since"] = known_last_modified
+            nodeinfo = self._session.get(known_url, headers=headers, timeout=self._req_timeout, allow_redirects=False)
+            if self.read_known_nodeinfo(nodeinfo, known_etag, known_last_modified):
+                self.nodeinfo_url = known_url
+                return
+            logger.debug(f"Nodeinfo of {self.domain} is not served from {known_url} anymore. Rediscovering it")
+        headers = InstanceInfo.get_nodeinfo_headers()
+        self.nodeinfo_url = InstanceInfo.discover_nodeinfo_url(self.domain, headers, req_timeout=self._req_timeout, session=self._session)
+        headers["Sec-Fetch-Site"] = "cross-site"
+        nodeinfo = self._session.get(self.nodeinfo_url, headers=headers, timeout=self._req_timeout)
+        self.node_info = nodeinfo.json()
+        self.nodeinfo_etag = nodeinfo.headers.get("ETag")
+        self.nodeinfo_last_modified = nodeinfo.headers.get("Last-Modified")
+
+    def read_known_nodeinfo(self, nodeinfo, known_etag, known_last_modified):
+        '''Reads the response of the stored nodeinfo URL.
+        Returns False when it is not a nodeinfo, such as an error, a redirect or an invalid JSON, so that it gets rediscovered
+        '''
+        if nodeinfo.status_code == 304:
+            self.nodeinfo_unchanged = True
+            self.nodeinfo_etag = nodeinfo.headers.get("ETag", known_etag)
+            self.nodeinfo_last_modified = nodeinfo.headers.get("Last-Modified", known_last_modified)
+            return True
+        if not 200 <= nodeinfo.status_code < 300:
+            return False
+        try:
+            self.node_info = nodeinfo.json()
+        except ValueError:
+            return False
+        self.nodeinfo_etag = nodeinfo.headers.get("ETag")
+        self.nodeinfo_last_modified = nodeinfo.headers.get("Last-Modified")
+        return True
+
     def get_instance_info(self):
         try:
             self.parse_instance_info()
@@ -102,7 +156,7 @@ class InstanceInfo():
                 "origin": "local",
                 "hostname": None
                 }
-            site_users = requests.post(f"https://{self.domain}/api/users", json=payload)
+            site_users = self._session.post(f"https://{self.domain}/api/users", json=payload)
             users_json = site_users.json()
             for user_entry in users_json:
                 if user_entry.get("isAdmin") is True:
@@ -180,7 +234,7 @@ class InstanceInfo():
         self.has_captcha = self.instance_info["site_view"]["local_site"]["captcha_enabled"]
 
     def get_mastodon_info(self):
-        site = requests.get(f"https://{self.domain}/api/v1/instance",timeout=self._req_timeout)
+        site = self._session.get(f"https://{self.domain}/api/v1/instance",timeout=self._req_timeout)
         try:
             self.instance_info = site.json()
         except Exception as err:
@@ -195,7 +249,7 @@ class InstanceInfo():
         self.has_captcha = None
 
     def get_pleroma_info(self):
-        site = requests.get(f"https://{self.domain}/api/v1/instance",timeout=self._req_timeout)
+        site = self._session.get(f"https://{self.domain}/api/v1/instance",timeout=self._req_timeout)
         try:
             self.instance_info = site.json()
         except Exception as err:
@@ -210,7 +264,7 @@ class InstanceInfo():
         self.has_captcha = None
 
     def get_firefish_info(self):
-        site = requests.get(f"https://{self.domain}/api/v1/instance",timeout=self._req_timeout)
+        site = self._session.get(f"https://{self.domain}/api/v1/instance",timeout=self._req_timeout)
         try:
             self.instance_info = site.json()
         except Exception as err:
@@ -230,7 +284,7 @@ class InstanceInfo():
 
     def discover_info(self):
         # Mastodon API
-        site = requests.get(f"https://{self.domain}/api/v1/instance",timeout=self._req_timeout,allow_redirects=False)
+        site = self._session.get(f"https://{self.domain}/api/v1/instance",timeout=self._req_timeout,allow_redirects=False)
 
         if site.status_code != 200:
             self.get_unknown_info()
@@ -293,7 +347,7 @@ class InstanceInfo():
             payload = {
                 "username": user
             }
-            user_info = requests.post(f"https://{self.domain}/api/users/show", timeout=self._req_timeout, json=payload).json()
+            user_info = self._session.post(f"https://{self.domain}/api/users/show", timeout=self._req_timeout, json=payload).json()
             admin = user_info.get('isAdmin', False)
             if admin:
                 self.admin_usernames.add(user)
@@ -301,8 +355,8 @@ class InstanceInfo():
         return admin
 
     @staticmethod
-    def get_nodeinfo(domain, req_timeout=3):
-        headers = {
+    def get_nodeinfo_headers():
+        return {
             "Sec-Fetch-Dest": "document",
             "Sec-Fetch-Mode": "navigate",
             "Sec-Fetch-Site": "none",
@@ -310,17 +364,26 @@ class InstanceInfo():
             "Sec-GPC": "1",
             "User-Agent": f"Fediseer/{FEDISEER_VERSION}",
         }
-        wellknown = requests.get(f"https://{domain}/.well-known/nodeinfo", headers=headers, timeout=req_timeout).json()
+
+    @staticmethod
+    def discover_nodeinfo_url(domain, headers, req_timeout=3, session=requests):
+        wellknown = session.get(f"https://{domain}/.well-known/nodeinfo", headers=headers, timeout=req_timeout).json()
+        return wellknown['links'][-1]['href']
+
+    @staticmethod
+    def get_nodeinfo(domain, req_timeout=3, session=requests):
+        headers = InstanceInfo.get_nodeinfo_headers()
+        nodeinfo_url = InstanceInfo.discover_nodeinfo_url(domain, headers, req_timeout=req_timeout, session=session)
         headers["Sec-Fetch-Site"] = "cross-site"
-        nodeinfo = requests.get(wellknown['links'][-1]['href'], headers=headers, timeout=req_timeout).json()
+        nodeinfo = session.get(nodeinfo_url, headers=headers, timeout=req_timeout).json()
         return nodeinfo
 
     @staticmethod
-    def is_reachable(domain, req_timeout=5):
+    def is_reachable(domain, req_timeout=5, session=requests):
         # Attempts to check if we can even reach the frontpage of the domain
         # so that we know if it's an issue reaching the nodeinfo, or a problem of reaching the domain
         logger.debug(domain)
-        req = requests.get(f"https://{domain}", timeout=req_timeout, allow_redirects=False)
+        req = session.get(f"https://{domain}", timeout=req_timeout, allow_redirects=False)
         logger.debug(req.status_code)
         if req.status_code not in [200,401,403]:
             raise Exception(f"Status code unexpected for instance frontpage: {req.status_code}")
@@ -0,0 +1,92 @@
+import time
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from publicsuffixlist import PublicSuffixList
+
+public_suffixes = PublicSuffixList()
+
+def get_host_key(domain):
+    '''Groups the domains by their registrable domain, so that the instances on subdomains of the same host share their slots.
+    Domains under a public suffix (e.g. *.co.uk) are not grouped, as they can belong to unrelated owners
+    '''
+    domain = domain.lower().rstrip(".")
+    registrable_domain = public_suffixes.privatesuffix(domain)
+    if registrable_domain is None:
+        return domain
+    return registrable_domain
+
+class Poller:
+    '''Runs a blocking poll function for many domains from a continuous work queue.
+    At most concurrency polls run at once, and at most per_host_concurrency of them against the same registrable domain,
+    so that a slow host only holds up its own slots.
+    The poll function runs in a thread pool, so it can keep using the blocking InstanceInfo logic
+    '''
+
+    def __init__(self, poll_function, concurrency, per_host_concurrency):
+        self.poll_function = poll_function
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.host_semaphores = {}
+        # Domains waiting for a poll of their busy host to finish
+        self.deferred_domains = {}
+        self.polled = 0
+        self.failed = 0
+
+    def get_host_semaphore(self, host_key):
+        if host_key not in self.host_semaphores:
+            self.host_semaphores[host_key] = asyncio.Semaphore(self.per_host_concurrency)
+        return self.host_semaphores[host_key]
+
+    async def poll(self, loop, executor, host_semaphore, domain):
+        async with host_semaphore:
+            try:
+                await loop.run_in_executor(executor, self.poll_function, domain)
+            except Exception as err:
+                self.failed += 1
+                logger.debug(f"Polling {domain} failed: {err}")
+            self.polled += 1
+
+    async def work(self, loop, executor, queue):
+        while True:
+            domain = await queue.get()
+            host_key = get_host_key(domain)
+            host_semaphore = self.get_host_semaphore(host_key)
+            if host_semaphore.locked():
+                # Rather than waiting for the busy host, we park the domain and let this slot poll other hosts meanwhile.
+                # Its task stays unfinished until a poll of the same host requeues it
+                self.deferred_domains.setdefault(host_key, deque()).append(domain)
+                continue
+            try:
+                await self.poll(loop, executor, host_semaphore, domain)
+            finally:
+                deferred = self.deferred_domains.get(host_key)
+                if deferred:
+                    queue.put_nowait(deferred.popleft())
+                    # The requeued domain is a new task, so its parked one is done
+                    queue.task_done()
+                    if not deferred:
+                        del self.deferred_domains[host_key]
+                queue.task_done()
+
+    async def run(self, domains):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        for domain in domains:
+            queue.put_nowait(domain)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            workers = [
+                asyncio.create_task(self.work(loop, executor, queue))
+                for _ in range(self.concurrency)
+            ]
+            await queue.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def poll_all(self, domains):
+        '''Polls all the domains and blocks until they are done'''
+        start = time.time()
+        asyncio.run(self.run(domains))
+        logger.info(f"Polled {self.polled} domains ({self.failed} failed) in {round(time.time() - start)} seconds")
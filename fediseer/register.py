@@ -5,13 +5,39 @@ from fediseer.flask import db
 import fediseer.exceptions as e
 from datetime import datetime
 from loguru import logger
+from concurrent.futures import ThreadPoolExecutor
+from fediseer.consts import REGISTRATION_POLL_WORKERS
+from fediseer.sessions import session_pool
 
-def ensure_instance_registered(domain, allow_unreachable=False, record_unreachable = False, allowed_timeout=5):
+def ensure_instance_registered(domain, allow_unreachable=False, record_unreachable = False, allowed_timeout=5, session=None, conditional=False):
+    '''session is the requests session to poll the domain with. If not provided, one is borrowed from the session_pool
+    The nodeinfo of known instances is retrieved from their stored nodeinfo_url, if it's still there.
+    If conditional is True, it is only retrieved if it changed since the last poll.
+    When it didn't, the instance is returned as stored and the returned InstanceInfo holds no info,
+    so this is only meant for refreshing instances.
+    '''
+    if session is None:
+        with session_pool.session() as session:
+            return ensure_instance_registered(domain, allow_unreachable, record_unreachable, allowed_timeout, session, conditional)
     if domain == "localhost":
         raise e.BadRequest("Cannot seek for localhost")
     instance = database.find_instance_by_domain(domain)
+    nodeinfo_validators = {}
+    if instance:
+        # The stored nodeinfo_url is tried before discovering it again
+        nodeinfo_validators["nodeinfo_url"] = instance.nodeinfo_url
+        if conditional:
+            nodeinfo_validators["nodeinfo_etag"] = instance.nodeinfo_etag
+            nodeinfo_validators["nodeinfo_last_modified"] = instance.nodeinfo_last_modified
     try:
-        instance_info = InstanceInfo(domain,allow_unreachable=allow_unreachable, req_timeout=allowed_timeout)
+        instance_info = InstanceInfo(domain,allow_unreachable=allow_unreachable, req_timeout=allowed_timeout, session=session, **nodeinfo_validators)
+        if instance_info.nodeinfo_unchanged:
+            logger.debug(f"Nodeinfo of {domain} unchanged")
+            if instance.poll_failures > 0:
+                instance.updated = datetime.utcnow()
+                instance.poll_failures = 0
+                db.session.commit()
+            return instance, instance_info
         instance_info.get_instance_info()
     except Exception as err:
         if record_unreachable and instance and instance.software != "wildcard":
@@ -35,6 +61,9 @@ def ensure_instance_registered(domain, allow_unreachable=False, record_unreachab
             instance.approval_required != instance_info.approval_required or
             instance.email_verify != instance_info.email_verify or
             instance.has_captcha != instance_info.has_captcha or
+            instance.nodeinfo_url != instance_info.nodeinfo_url or
+            instance.nodeinfo_etag != instance_info.nodeinfo_etag or
+            instance.nodeinfo_last_modified != instance_info.nodeinfo_last_modified or
             instance.poll_failures > 0
         ):
             # logger.debug(["new",instance_info.software,instance_info.open_registrations,instance_info.approval_required,instance_info.email_verify,instance_info.has_captcha])        
@@ -46,15 +75,25 @@ def ensure_instance_registered(domain, allow_unreachable=False, record_unreachab
             instance.approval_required = instance_info.approval_required
             instance.email_verify = instance_info.email_verify
             instance.has_captcha = instance_info.has_captcha
+            instance.nodeinfo_url = instance_info.nodeinfo_url
+            instance.nodeinfo_etag = instance_info.nodeinfo_etag
+            instance.nodeinfo_last_modified = instance_info.nodeinfo_last_modified
             instance.updated = datetime.utcnow()
             instance.poll_failures = 0
             db.session.commit()
         return instance, instance_info
+    new_instance = build_instance(domain, instance_info, instance_info.domain_exists())
+    new_instance.create()
+    database.invalidate_instance_totals()
+    return new_instance, instance_info
+
+def build_instance(domain, instance_info, domain_exists):
+    '''Prepares a new instance from its polled info. The caller is responsible for adding it to the DB'''
     poll_failures = 0
-    if not instance_info.domain_exists():
+    if not domain_exists:
         # If the domain is gone, we assume straight decommission
         poll_failures = 100
-    new_instance = Instance(
+    return Instance(
         domain=domain.lower(),
         open_registrations=instance_info.open_registrations,
         email_verify=instance_info.email_verify,
@@ -63,6 +102,46 @@ def ensure_instance_registered(domain, allow_unreachable=False, record_unreachab
         software=instance_info.software,
         version=instance_info.version,
         poll_failures=poll_failures,
+        nodeinfo_url=instance_info.nodeinfo_url,
+        nodeinfo_etag=instance_info.nodeinfo_etag,
+        nodeinfo_last_modified=instance_info.nodeinfo_last_modified,
     )
-    new_instance.create()
-    return new_instance, instance_info
\ No newline at end of file
+
+def poll_new_instance(domain, allowed_timeout):
+    '''Retrieves the info of an unknown domain without touching the DB, so that it can run in a worker thread'''
+    with session_pool.session() as session:
+        instance_info = InstanceInfo(domain, allow_unreachable=True, req_timeout=allowed_timeout, session=session)
+        try:
+            instance_info.get_instance_info()
+        except Exception as err:
+            logger.debug(f"Could not retrieve info for {domain}: {err}")
+    return instance_info, instance_info.domain_exists()
+
+def ensure_instances_registered(domains, allowed_timeout=5):
+    '''Ensures multiple domains are registered at once, for batch operations.
+    Known instances are returned as they are stored, as the updater keeps their info current.
+    Unknown domains are polled concurrently and are registered even when unreachable,
+    so that the updater can fill in their info later.
+    Returns a dict of each requested domain to its instance
+    '''
+    domains = set(d for d in domains if d != "localhost")
+    instances = {}
+    for instance in database.find_multiple_instance_by_domains(domains):
+        instances[instance.domain] = instance
+    unknown_domains = set(d.lower() for d in domains) - set(instances.keys())
+    if len(unknown_domains) > 0:
+        logger.debug(f"Polling {len(unknown_domains)} unknown domains for registration")
+        with ThreadPoolExecutor(max_workers=min(len(unknown_domains), REGISTRATION_POLL_WORKERS)) as executor:
+            futures = {
+                domain: executor.submit(poll_new_instance, domain, allowed_timeout)
+                for domain in unknown_domains
+            }
+        for domain, future in futures.items():
+            instance_info, domain_exists = future.result()
+            db.session.add(build_instance(domain, instance_info, domain_exists))
+        db.session.commit()
+        database.invalidate_instance_totals()
+        # Reloading them in one query is cheaper than refreshing each expired instance on access
+        for instance in database.find_multiple_instance_by_domains(unknown_domains):
+            instances[instance.domain] = instance
+    return {d: instances.get(d.lower()) for d in domains}
\ No newline at end of file
@@ -0,0 +1,152 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from loguru import logger
+from fediseer.consts import (
+    FEDISEER_VERSION,
+    HTTP_SESSION_POOL_SIZE,
+    HTTP_HOSTS_PER_SESSION,
+    HTTP_CONNECTIONS_PER_HOST,
+    HTTP_RETRIES,
+    HTTP_RETRY_BACKOFF,
+    HTTP_RETRY_BACKOFF_MAX,
+)
+
+class SessionPool:
+    '''A size-bounded pool of requests sessions, which keep their connections alive between requests.
+    Each session is used by one thread at a time. When all sessions are in use, borrowers wait for one to be returned.
+    Failed connections, and responses with one of the retry_statuses, are retried with an exponential backoff
+    capped at HTTP_RETRY_BACKOFF_MAX seconds. Retry-After headers are ignored, so a remote instance cannot hold a thread for long.
+    '''
+
+    def __init__(self, size, hosts_per_session, connections_per_host, retries, backoff_factor, retry_statuses=()):
+        self.size = size
+        self.hosts_per_session = hosts_per_session
+        self.connections_per_host = connections_per_host
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.retry_statuses = retry_statuses
+        self.idle_sessions = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.created_sessions = 0
+        self.requests = 0
+        self.connections = 0
+
+    def count_connection(self):
+        with self.lock:
+            self.connections += 1
+
+    def count_response(self, response, *args, **kwargs):
+        with self.lock:
+            self.requests += 1
+
+    def create_session(self):
+        session = requests.Session()
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            # Retrying slow instances would only multiply their timeouts
+            read=0,
+            status=self.retries,
+            status_forcelist=self.retry_statuses,
+            backoff_factor=self.backoff_factor,
+            backoff_max=HTTP_RETRY_BACKOFF_MAX,
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        adapter = CountingHTTPAdapter(
+            self,
+            pool_connections=self.hosts_per_session,
+            pool_maxsize=self.connections_per_host,
+            max_retries=retry,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers["User-Agent"] = f"Fediseer/{FEDISEER_VERSION}"
+        session.hooks["response"].append(self.count_response)
+        return session
+
+    @contextmanager
+    def session(self):
+        '''Borrows a session for the duration of the context'''
+        try:
+            session = self.idle_sessions.get_nowait()
+        except queue.Empty:
+            session = None
+            with self.lock:
+                if self.created_sessions < self.size:
+                    self.created_sessions += 1
+                    session = self.create_session()
+            if session is None:
+                session = self.idle_sessions.get()
+        try:
+            yield session
+        finally:
+            self.idle_sessions.put(session)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "sessions": self.created_sessions,
+                "requests": self.requests,
+                "connections": self.connections,
+                "reused": max(self.requests - self.connections, 0),
+            }
+
+    def log_stats(self):
+        stats = self.get_stats()
+        reuse_ratio = round(stats["reused"] / stats["requests"], 3) if stats["requests"] else 0
+        logger.info(
+            f"HTTP sessions: {stats['sessions']}/{self.size} sessions, {stats['requests']} requests, "
+            f"{stats['connections']} new connections, {stats['reused']} requests on reused connections ({reuse_ratio} reuse ratio)"
+        )
+
+class CountingHTTPAdapter(HTTPAdapter):
+    '''Counts the connections its pools open into the SessionPool statistics'''
+
+    def __init__(self, session_pool, *args, **kwargs):
+        self.session_pool = session_pool
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        session_pool = self.session_pool
+
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                session_pool.count_connection()
+                return super()._new_conn()
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                session_pool.count_connection()
+                return super()._new_conn()
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+# Used while serving API requests, so only failed connections are retried
+session_pool = SessionPool(
+    size=HTTP_SESSION_POOL_SIZE,
+    hosts_per_session=HTTP_HOSTS_PER_SESSION,
+    connections_per_host=HTTP_CONNECTIONS_PER_HOST,
+    retries=HTTP_RETRIES,
+    backoff_factor=HTTP_RETRY_BACKOFF,
+)
+
+# Used by the updater, which can afford to retry overloaded instances
+updater_session_pool = SessionPool(
+    size=int(os.getenv("FEDISEER_HTTP_SESSIONS", HTTP_SESSION_POOL_SIZE)),
+    hosts_per_session=HTTP_HOSTS_PER_SESSION,
+    connections_per_host=HTTP_CONNECTIONS_PER_HOST,
+    retries=HTTP_RETRIES,
+    backoff_factor=HTTP_RETRY_BACKOFF,
+    retry_statuses=(429, 502, 503, 504),
+)
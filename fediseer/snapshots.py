@@ -0,0 +1,128 @@
+import os
+import sys
+import gzip
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from flask import request, Response
+from loguru import logger
+from fediseer.flask import OVERSEER
+from fediseer.consts import SNAPSHOT_VERSIONS_KEPT
+
+def get_snapshot_directory():
+    snapshot_dir = os.getenv("FEDISEER_SNAPSHOT_DIR")
+    if snapshot_dir:
+        return snapshot_dir
+    return os.path.dirname(os.path.abspath(sys.modules['__main__'].__file__))
+
+class Snapshot:
+    '''A response body which is expensive to build, served from precompressed files.
+    Each build is published as a new versioned file named {name}.{version}.{etag}.json.gz,
+    written to a temporary file first and moved in place, so readers never see a partial snapshot.
+    Stale snapshots keep being served while a single background rebuild replaces them.
+    '''
+
+    def __init__(self, name, build_function, max_age):
+        self.name = name
+        self.build_function = build_function
+        self.max_age = max_age
+        self.rebuild_lock = threading.Lock()
+        # The latest loaded (version, etag, gzipped body)
+        self.current = None
+
+    def list_versions(self, directory):
+        versions = []
+        for filename in os.listdir(directory):
+            parts = filename.split('.')
+            if len(parts) != 5 or parts[0] != self.name or parts[3:] != ["json", "gz"]:
+                continue
+            try:
+                versions.append((int(parts[1]), parts[2], filename))
+            except ValueError:
+                continue
+        return sorted(versions)
+
+    def load_latest(self):
+        '''Returns the latest published snapshot, or None if there is none'''
+        directory = get_snapshot_directory()
+        versions = self.list_versions(directory)
+        if len(versions) == 0:
+            return None
+        version, etag, filename = versions[-1]
+        current = self.current
+        if current is not None and current[0] == version:
+            return current
+        try:
+            with open(os.path.join(directory, filename), "rb") as f:
+                self.current = (version, etag, f.read())
+        except FileNotFoundError:
+            # Removed by a newer publication since we listed the directory
+            return self.load_latest()
+        return self.current
+
+    def publish(self):
+        '''Builds and publishes a new snapshot version. The rebuild_lock has to be held'''
+        start = time.time()
+        with OVERSEER.app_context():
+            body = json.dumps(self.build_function(), separators=(',', ':')).encode()
+        etag = hashlib.sha1(body).hexdigest()
+        version = time.time_ns()
+        directory = get_snapshot_directory()
+        file_descriptor, temp_path = tempfile.mkstemp(prefix=f".{self.name}.", dir=directory)
+        try:
+            with os.fdopen(file_descriptor, "wb") as f:
+                f.write(gzip.compress(body))
+            os.replace(temp_path, os.path.join(directory, f"{self.name}.{version}.{etag}.json.gz"))
+        except Exception:
+            os.unlink(temp_path)
+            raise
+        # Older versions are kept for a while, in case they are still being read
+        for _, _, filename in self.list_versions(directory)[:-SNAPSHOT_VERSIONS_KEPT]:
+            try:
+                os.unlink(os.path.join(directory, filename))
+            except FileNotFoundError:
+                pass
+        logger.info(f"Published {self.name} snapshot {version} in {round(time.time() - start, 2)} seconds")
+
+    def rebuild_in_background(self):
+        if not self.rebuild_lock.acquire(blocking=False):
+            # A rebuild is already running
+            return
+        def rebuild():
+            try:
+                self.publish()
+            except Exception as err:
+                logger.error(f"Failed to rebuild the {self.name} snapshot: {err}")
+            finally:
+                self.rebuild_lock.release()
+        threading.Thread(target=rebuild, daemon=True).start()
+
+    def get(self):
+        '''Returns the (version, etag, gzipped body) of the latest snapshot, building one if needed'''
+        snapshot = self.load_latest()
+        if snapshot is None:
+            with self.rebuild_lock:
+                # Another request might have published it while we waited
+                snapshot = self.load_latest()
+                if snapshot is None:
+                    self.publish()
+                    snapshot = self.load_latest()
+        elif time.time() - snapshot[0] / 1e9 >= self.max_age:
+            self.rebuild_in_background()
+        return snapshot
+
+    def serve(self):
+        '''Responds with the latest snapshot, or with a 304 if the client already has it'''
+        version, etag, body = self.get()
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        elif "gzip" in request.accept_encodings:
+            response = Response(body, mimetype="application/json")
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = Response(gzip.decompress(body), mimetype="application/json")
+        response.set_etag(etag)
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
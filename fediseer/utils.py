@@ -6,10 +6,12 @@ import os
 import random
 import regex as re
 import json
+import base64
 from datetime import datetime
 import dateutil.relativedelta
 from loguru import logger
 from fediseer.flask import SQLITE_MODE
+from fediseer.consts import REASON_FILTER_MACROS
 
 random.seed(random.SystemRandom().randint(0, 2**32 - 1))
 
@@ -76,6 +78,53 @@ def hash_dictionary(dictionary):
     hash_hex = hash_object.hexdigest()
     return hash_hex
 
+def encode_cursor(*values):
+    '''Packs the keyset values of the last returned row into an opaque pagination cursor'''
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor, *value_types):
+    '''Unpacks a pagination cursor created by encode_cursor() into a tuple of values of the expected types.
+    Returns None if the cursor is not valid
+    '''
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(value_types):
+            return None
+        decoded = []
+        for value, value_type in zip(values, value_types):
+            if value_type == datetime:
+                decoded.append(datetime.fromisoformat(value))
+            else:
+                decoded.append(value_type(value))
+        return tuple(decoded)
+    except (ValueError, TypeError):
+        return None
+
+def group_by_attribute(rows, attribute):
+    '''Groups the rows into lists by the value of one of their attributes, in a single pass.
+    Used to match the given censures, endorsements and hesitations to the instances they target
+    '''
+    grouped_rows = {}
+    for row in rows:
+        grouped_rows.setdefault(getattr(row, attribute), []).append(row)
+    return grouped_rows
+
+def normalize_tag(tag):
+    '''The form under which tags differing only in case or surrounding whitespace are merged'''
+    return tag.strip().lower()
+
+def parse_reasons_csv(reasons_csv):
+    '''Converts a reasons_csv filter into the set of lowercase terms to match, expanding any macros'''
+    reasons_filter = set()
+    for reason in reasons_csv.split(','):
+        reason = reason.strip().lower()
+        if reason in REASON_FILTER_MACROS:
+            reasons_filter.update(REASON_FILTER_MACROS[reason])
+        elif reason != '':
+            reasons_filter.add(reason)
+    return reasons_filter
+
 def get_expiry_date():
     return datetime.utcnow() + dateutil.relativedelta.relativedelta(minutes=+20)
 
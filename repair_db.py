@@ -0,0 +1,25 @@
+from dotenv import load_dotenv
+import os
+import logging
+
+load_dotenv()
+
+from loguru import logger
+from fediseer.flask import OVERSEER, db
+import fediseer.database.functions as database
+
+# Rebuilds all denormalized columns from their source tables.
+# Run this after applying the sql_statements of a new version, or whenever the stored state is suspected to have drifted
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(module)s:%(lineno)d - %(message)s', level=logging.WARNING)
+    logger.init("Database Repair", status="Starting")
+    with OVERSEER.app_context():
+        repaired = database.rebuild_chain_roots()
+        logger.info(f"Repaired guarantee chain state for {repaired} instances")
+        recounted = database.refresh_instance_counters()
+        db.session.commit()
+        logger.info(f"Recounted relationship counters for {recounted} instances")
+        tags = database.rebuild_tag_counts()
+        db.session.commit()
+        logger.info(f"Recounted usage of {tags} tags")
+    logger.init("Database Repair", status="Ended")
@@ -8,11 +8,13 @@ from loguru import logger
 from fediseer.flask import OVERSEER, db 
 import fediseer.database.functions as database
 from fediseer.register import ensure_instance_registered
-from concurrent.futures import ThreadPoolExecutor
+from fediseer.poller import Poller
+from fediseer.sessions import updater_session_pool
+from fediseer import consts
 
 def refresh_info(domain):
     logger.info(f"Refreshing domain '{domain}")
-    with OVERSEER.app_context():
+    with OVERSEER.app_context(), updater_session_pool.session() as session:
         try:
             ensure_instance_registered(
                 domain,
@@ -21,7 +23,9 @@ def refresh_info(domain):
                 # Which will cause the poll_failures not not increment
                 allow_unreachable=False,
                 record_unreachable=True,
-                allowed_timeout=20
+                allowed_timeout=20,
+                session=session,
+                conditional=True,
             )
         except Exception as err:
             pass
@@ -42,23 +46,23 @@ if __name__ == "__main__":
     #         )         
     # except Exception as err:
     #     logger.error(err)
-    futures = []
-    with ThreadPoolExecutor(max_workers=int(os.getenv('FEDISEER_UPDATE_THREADS', 25))) as executor:
-        with OVERSEER.app_context():
-            for instance in database.get_all_instances(0,0,limit=1000000):
-                if instance.software == 'wildcard':
-                    continue
-                # -1 doesn't skip anything
-                if int(os.getenv('FEDISEER_IGNORE_POLL_FAILS', -1)) >= 0 and instance.poll_failures > int(os.getenv('FEDISEER_IGNORE_POLL_FAILS', 0)):
-                    logger.debug(f"Skipped {instance.domain} due to too many poll fails.")
-                    continue
-                futures.append(executor.submit(refresh_info, instance.domain))
-                if len(futures) >= 500:
-                    for future in futures:
-                        future.result()
-                    futures = []
-            for future in futures:
-                future.result()
+    domains = []
+    with OVERSEER.app_context():
+        for instance in database.get_all_instances(0,0,limit=1000000):
+            if instance.software == 'wildcard':
+                continue
+            # -1 doesn't skip anything
+            if int(os.getenv('FEDISEER_IGNORE_POLL_FAILS', -1)) >= 0 and instance.poll_failures > int(os.getenv('FEDISEER_IGNORE_POLL_FAILS', 0)):
+                logger.debug(f"Skipped {instance.domain} due to too many poll fails.")
+                continue
+            domains.append(instance.domain)
+    poller = Poller(
+        refresh_info,
+        concurrency=int(os.getenv('FEDISEER_UPDATE_THREADS', consts.UPDATER_CONCURRENCY)),
+        per_host_concurrency=int(os.getenv('FEDISEER_UPDATE_PER_HOST', consts.UPDATER_PER_HOST_CONCURRENCY)),
+    )
+    poller.poll_all(domains)
+    updater_session_pool.log_stats()
 
     logger.init("Updater", status="Ended")
 []
\ No newline at end of file